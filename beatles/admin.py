@@ -2,9 +2,11 @@ from django.contrib import admin
 
 # Register your models here.
 from django.contrib import admin
-from .models import Album, Song, SongWriter, Singer
+from .models import Album, Song, SongWriter, Singer, SongChange, ImportLease
 
 admin.site.register(Album)
 admin.site.register(Song)
 admin.site.register(SongWriter)
-admin.site.register(Singer)
\ No newline at end of file
+admin.site.register(Singer)
+admin.site.register(SongChange)
+admin.site.register(ImportLease)
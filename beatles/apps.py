@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class BeatlesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'beatles'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .catalog import warm_start
+
+        # Fill the in-process catalog so a new worker starts warm, if enabled
+        warm_start()
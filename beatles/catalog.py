@@ -0,0 +1,199 @@
+"""
+In-process snapshot of the song catalog.
+
+When CATALOG_SNAPSHOT is set, the catalog is loaded once when the app
+starts (see BeatlesConfig.ready), either from a snapshot file written by
+`manage.py dump_catalog_snapshot` or with a few bulk queries, so a new
+worker answers the song list and lyrics lookups without round trips to
+the database. The catalog only serves reads: writes look up albums,
+writers and singers in the database, as the cached ids may be stale.
+
+The catalog is dropped whenever a song, album, writer or singer changes
+in this process, and CATALOG_CACHE_TTL seconds after it was read from the
+database to pick up changes made by other processes. It is then reloaded
+from the database on the next read. A snapshot file records when it was
+read, so a worker started from an older file loads the catalog from the
+database instead.
+"""
+import gzip
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .models import Song
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 2
+
+# Fields of the songs served to unauthenticated users, see LimitedSongSerializer
+LIMITED_FIELDS = ('name', 'album', 'writers', 'rank')
+
+
+class Catalog:
+    """
+    Read-only view of every song, ordered by rank.
+
+    Songs are stored as serialized by SongSerializer, `read_at` is when
+    they were read from the database (a time.time() timestamp, now by default).
+    """
+
+    def __init__(self, songs, read_at=None):
+        self.songs = songs
+        self.limited_songs = [{field: song[field] for field in LIMITED_FIELDS} for song in songs]
+        self.songs_by_id = {song['id']: song for song in songs}
+        self.songs_by_name = {}
+        for song in songs:
+            self.songs_by_name.setdefault(song['name'].lower(), song)
+        self.read_at = time.time() if read_at is None else read_at
+        # The age of the data counts towards CATALOG_CACHE_TTL, not just the time since it was loaded
+        self.loaded_at = time.monotonic() - max(0.0, time.time() - self.read_at)
+
+    def is_fresh(self):
+        return time.monotonic() - self.loaded_at < settings.CATALOG_CACHE_TTL
+
+    def find_song(self, song_identifier):
+        """
+        Finds a song by id or by name (case insensitive, hyphens for spaces),
+        like LyricsView does. Returns the serialized song or None.
+        """
+        try:
+            song = self.songs_by_id.get(int(song_identifier))
+            if song is not None:
+                return song
+        except ValueError:
+            pass
+        return self.songs_by_name.get(song_identifier.replace('-', ' ').lower())
+
+    def to_dict(self):
+        return {
+            'version': SNAPSHOT_VERSION,
+            'read_at': self.read_at,
+            'songs': self.songs,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported catalog snapshot version: {data.get('version')}")
+        return cls(data['songs'], data['read_at'])
+
+    @classmethod
+    def from_db(cls):
+        """
+        Loads the catalog with one query per table.
+        """
+        from .serializers import SongSerializer
+
+        songs = Song.objects.select_related('album').prefetch_related('writers', 'singers').order_by('rank')
+        return cls(json.loads(json.dumps(SongSerializer(songs, many=True).data)))
+
+    @classmethod
+    def from_file(cls, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            return cls.from_dict(json.load(file))
+
+    def dump(self, path):
+        """
+        Writes the catalog to a gzip-compressed JSON snapshot file.
+        """
+        with gzip.open(path, 'wt', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, separators=(',', ':'))
+
+
+_catalog = None
+# Serializes the reloads, so a stale catalog is only reloaded once
+_catalog_lock = threading.Lock()
+# Bumped each time the catalog is dropped, so a catalog read from the
+# database before a drop is not kept
+_catalog_generation = 0
+_generation_lock = threading.Lock()
+
+
+def warm_start():
+    """
+    Loads the catalog as configured by CATALOG_SNAPSHOT: 'db' for bulk
+    queries, or the path of a snapshot file, unless the file is older than
+    CATALOG_CACHE_TTL. Failures are logged and leave the catalog to be
+    loaded on first use.
+    """
+    source = settings.CATALOG_SNAPSHOT
+    if not source:
+        return
+
+    def load():
+        catalog = Catalog.from_db() if source == 'db' else Catalog.from_file(source)
+        if not catalog.is_fresh():
+            logger.info('The catalog snapshot %s is out of date, loading the catalog from the database', source)
+            catalog = Catalog.from_db()
+        return catalog
+
+    try:
+        with _catalog_lock:
+            _load_catalog(load)
+    except (DatabaseError, OSError, ValueError):
+        logger.warning('Could not load the catalog snapshot from %s', source, exc_info=True)
+
+
+def get_catalog(reload=True):
+    """
+    Returns the current catalog, or None when the catalog is disabled or
+    can not be loaded. A stale catalog is reloaded from the database,
+    unless `reload` is False, in which case None is returned instead.
+    """
+    if not settings.CATALOG_SNAPSHOT:
+        return None
+    catalog = _catalog
+    if catalog is not None and catalog.is_fresh():
+        return catalog
+    if not reload:
+        return None
+
+    with _catalog_lock:
+        # Another thread may have reloaded it while we waited for the lock
+        if _catalog is not None and _catalog.is_fresh():
+            return _catalog
+        try:
+            return _load_catalog(Catalog.from_db)
+        except DatabaseError:
+            logger.warning('Could not load the catalog', exc_info=True)
+            return None
+
+
+def _load_catalog(load):
+    """
+    Loads a catalog with `load` and keeps it, unless the catalog was dropped
+    while loading, as it may then miss the change that dropped it. Returns
+    the catalog kept, or None.
+    """
+    global _catalog
+    with _generation_lock:
+        generation = _catalog_generation
+    catalog = load()
+    with _generation_lock:
+        if _catalog_generation != generation:
+            return None
+        _catalog = catalog
+    return catalog
+
+
+def invalidate_catalog():
+    """
+    Drops the catalog so it is reloaded on the next read. It is dropped
+    again once the current transaction commits, in case it was reloaded
+    in between from uncommitted data.
+    """
+    _drop_catalog()
+    transaction.on_commit(_drop_catalog)
+
+
+def _drop_catalog():
+    global _catalog, _catalog_generation
+    with _generation_lock:
+        _catalog_generation += 1
+        _catalog = None
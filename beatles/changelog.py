@@ -0,0 +1,55 @@
+"""
+Writes the song change log (SongChange) read by the change feed.
+
+Changes are recorded by the model signals in signals.py. Code that
+creates songs in bulk, or in several steps, pauses the signals and records
+a single change per song itself.
+
+The feed uses the change ids as its cursor, so ids must become visible in
+order: a change written inside a long transaction would otherwise get a
+lower id than changes committed before it, and a client could move its
+cursor past it before it shows up. Changes are therefore only written once
+their transaction commits, in a short statement of their own (a change is
+lost if that statement fails after the commit), and the feed holds back
+the changes of the last SONG_CHANGES_SAFETY_LAG seconds.
+"""
+from contextlib import contextmanager
+import contextvars
+
+from django.db import transaction
+
+from .models import SongChange
+
+
+_signals_paused = contextvars.ContextVar('song_change_signals_paused', default=False)
+
+
+@contextmanager
+def pause_change_signals():
+    """
+    Stops the model signals from recording changes within the block.
+    """
+    token = _signals_paused.set(True)
+    try:
+        yield
+    finally:
+        _signals_paused.reset(token)
+
+
+def change_signals_paused():
+    return _signals_paused.get()
+
+
+def record_changes(song_ids, action):
+    """
+    Appends a change to the log for each of the given songs, once the
+    current transaction commits (right away outside of a transaction).
+
+    Args:
+    song_ids (iterable): Ids of the changed songs.
+    action (str): One of SongChange.CREATED, UPDATED or DELETED.
+    """
+    song_ids = list(song_ids)
+    transaction.on_commit(lambda: SongChange.objects.bulk_create([
+        SongChange(song_id=song_id, action=action) for song_id in song_ids
+    ]))
@@ -0,0 +1,359 @@
+"""
+Parallel parsing of song CSV uploads.
+
+The file is split into chunks on record boundaries (newlines that are not
+inside a quoted field), each chunk is validated and parsed into typed rows
+in a worker process, and the rows are handed back to the caller in file
+order along with the reason any record was rejected.
+
+This module deliberately does not import any Django models so that it can
+be loaded cheaply by the worker processes. Workers are started from a fork
+server (or spawned where there is none) rather than forked from the web
+process, whose other threads could leave locks held in the children.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import csv
+import io
+import multiprocessing
+import os
+import re
+
+
+# Start method of the worker processes, never 'fork'
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Size of the blocks read from the uploaded file and handed to the workers
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+
+# Largest cell accepted, in characters (csv's own default)
+DEFAULT_FIELD_SIZE_LIMIT = 128 * 1024
+
+# Upper bound of the integer columns in the database
+MAX_INTEGER = 2 ** 31 - 1
+
+# Mapping of CSV column names to Song fields holding plain integers, with
+# the lowest value accepted for each
+INTEGER_COLUMNS = {
+    'Rank': ('rank', 1),
+    'Rolling Stone 100 Greatest Beatles Songs Ranking': ('rolling_stone_ranking', 1),
+    'UG Views': ('ug_views', 0),
+    'UG Favourites': ('ug_favourites', 0),
+}
+
+REQUIRED_COLUMNS = [
+    'Song Name', 'Album', 'Song Writer', 'Singer', 'Year Released', 'Song Time',
+    'Spotify Streams', 'NME Top 50 Beatles Songs Ranking', *INTEGER_COLUMNS,
+]
+
+MIN_YEAR, MAX_YEAR = 1900, 2100
+
+SONG_TIME_PATTERN = re.compile(r'^\d{1,2}(:\d{2}){1,2}$')
+
+
+def split_records(file, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Splits a binary file into chunks that only end on record boundaries.
+
+    A newline is a record boundary when an even number of quote characters
+    precede it, since escaped quotes ('""') always come in pairs.
+
+    Args:
+    file: A binary file-like object positioned after the header row.
+    chunk_bytes (int): Approximate size of each chunk.
+
+    Yields:
+    bytes: Chunks of complete CSV records.
+    """
+    pending = b''
+    # Parity of the quote characters in `pending`
+    pending_quotes = 0
+
+    while True:
+        block = file.read(chunk_bytes)
+        if not block:
+            break
+
+        data = pending + block
+        total_quotes = pending_quotes + block.count(b'"')
+
+        # Walk back from the end of the data to the last newline outside quotes
+        end = len(data)
+        quotes_after = 0
+        boundary = -1
+        while True:
+            newline = data.rfind(b'\n', 0, end)
+            if newline < 0:
+                break
+            quotes_after += data.count(b'"', newline, end)
+            if (total_quotes - quotes_after) % 2 == 0:
+                boundary = newline
+                break
+            end = newline
+
+        if boundary < 0:
+            # No complete record yet, keep reading
+            pending, pending_quotes = data, total_quotes % 2
+            continue
+
+        yield data[:boundary + 1]
+        pending = data[boundary + 1:]
+        pending_quotes = quotes_after % 2
+
+    if pending.strip():
+        yield pending
+
+
+def parse_int(value, column, minimum, maximum=MAX_INTEGER):
+    """
+    Converts a cell to an integer within [minimum, maximum].
+
+    Raises:
+    ValueError: With a readable reason if the cell is not a valid integer.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"'{column}' is not an integer: {value!r}")
+    if not minimum <= number <= maximum:
+        raise ValueError(f"'{column}' must be between {minimum} and {maximum}: {number}")
+    return number
+
+
+def parse_names(value, column, max_length=100):
+    """
+    Splits a multiline cell into the names it lists.
+    """
+    names = [name.strip() for name in value.split('\n') if name.strip()]
+    if not names:
+        raise ValueError(f"'{column}' is empty")
+    for name in names:
+        if len(name) > max_length:
+            raise ValueError(f"'{column}' name is longer than {max_length} characters: {name!r}")
+    return names
+
+
+def parse_row(values, columns):
+    """
+    Validates a CSV record and converts it into typed Song data.
+
+    Args:
+    values (list): The cells of the record, as produced by csv.reader.
+    columns (dict): Column name -> cell index, taken from the header row.
+
+    Returns:
+    dict: Song field values, with 'album', 'writers' and 'singers' holding names
+    and 'lyrics' holding the lyrics text, if any.
+
+    Raises:
+    ValueError: With a readable reason if any cell is missing or invalid.
+    """
+    if len(values) != len(columns):
+        raise ValueError(f'Expected {len(columns)} columns, found {len(values)}')
+
+    song = {}
+    for column, field in (('Song Name', 'name'), ('Album', 'album')):
+        value = values[columns[column]].strip()
+        if not value:
+            raise ValueError(f"'{column}' is empty")
+        if len(value) > 200:
+            raise ValueError(f"'{column}' is longer than 200 characters")
+        song[field] = value
+
+    song_time = values[columns['Song Time']].strip()
+    if not SONG_TIME_PATTERN.match(song_time):
+        raise ValueError(f"'Song Time' is not a duration like '02:32': {song_time!r}")
+    song['song_time'] = song_time
+
+    song['year_released'] = parse_int(values[columns['Year Released']], 'Year Released', MIN_YEAR, MAX_YEAR)
+    song['spotify_streams'] = parse_int(
+        values[columns['Spotify Streams']].replace(',', ''), 'Spotify Streams', 0
+    )
+    for column, (field, minimum) in INTEGER_COLUMNS.items():
+        song[field] = parse_int(values[columns[column]], column, minimum)
+
+    # Not every song is ranked by NME, so an empty cell is allowed
+    nme_ranking = values[columns['NME Top 50 Beatles Songs Ranking']].strip()
+    song['nme_ranking'] = (
+        parse_int(nme_ranking, 'NME Top 50 Beatles Songs Ranking', 1) if nme_ranking else None
+    )
+
+    song['writers'] = parse_names(values[columns['Song Writer']], 'Song Writer')
+    song['singers'] = parse_names(values[columns['Singer']], 'Singer')
+
+    # The lyrics column is optional, lyrics can also come from an archive
+    lyrics = values[columns['Lyrics']].strip() if 'Lyrics' in columns else ''
+    song['lyrics'] = lyrics or None
+    return song
+
+
+def parse_chunk(chunk, columns, field_size_limit=DEFAULT_FIELD_SIZE_LIMIT):
+    """
+    Validates a chunk of complete CSV records and converts them into typed
+    Song data.
+
+    Args:
+    chunk (bytes): UTF-8 encoded CSV records without a header row.
+    columns (dict): Column name -> cell index, taken from the header row.
+    field_size_limit (int): Largest cell accepted, in characters.
+
+    Returns:
+    list: A (song, error) pair per record, where exactly one of the two is
+    set. Blank lines give a (None, None) pair so record numbers stay aligned.
+    """
+    csv.field_size_limit(field_size_limit)
+    results = []
+    for values in read_records(chunk.decode('utf-8')):
+        if isinstance(values, csv.Error):
+            results.append((None, f'Malformed CSV record: {values}'))
+            continue
+        if not values:
+            results.append((None, None))
+            continue
+        try:
+            results.append((parse_row(values, columns), None))
+        except ValueError as error:
+            results.append((None, str(error)))
+    return results
+
+
+def read_records(text):
+    """
+    Reads the CSV records of a chunk. A record that csv.reader can not read
+    (a cell over the field size limit, an unterminated quote) gives its
+    csv.Error in place of its cells, and the records after it are still read.
+    """
+    # An odd number of quotes means the last record never closes its quote
+    if text.count('"') % 2 == 0:
+        try:
+            return list(csv.reader(io.StringIO(text, newline='')))
+        except csv.Error:
+            pass
+
+    # Read record by record, split on the same boundaries as split_records
+    records = []
+    record = []
+    quotes = 0
+    lines = text.split('\n')
+    for index, line in enumerate(lines):
+        record.append(line if index == len(lines) - 1 else line + '\n')
+        quotes += line.count('"')
+        if quotes % 2 == 0 and any(record):
+            records.append(_read_record(''.join(record)))
+            record = []
+    if any(record):
+        records.append(csv.Error('unterminated quoted field'))
+    return records
+
+
+def _read_record(record):
+    try:
+        return next(csv.reader([record]), [])
+    except csv.Error as error:
+        return error
+
+
+def read_header(file):
+    """
+    Reads the header row from a binary file, leaving the file positioned
+    at the first record.
+
+    Returns:
+    dict: Column name -> cell index.
+
+    Raises:
+    ValueError: If any of the required columns is missing.
+    """
+    line = file.readline().decode('utf-8')
+    try:
+        fieldnames = next(csv.reader([line]), [])
+    except csv.Error as error:
+        raise ValueError(f'Malformed header row: {error}')
+    columns = {name.strip(): index for index, name in enumerate(fieldnames)}
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+    return columns
+
+
+def iter_song_rows(file, workers=None, chunk_bytes=DEFAULT_CHUNK_BYTES, field_size_limit=DEFAULT_FIELD_SIZE_LIMIT):
+    """
+    Validates a song CSV file, in parallel when it spans more than one chunk.
+
+    Records are yielded in file order. Besides the per-record checks, a
+    record is rejected when its song (same name and album) or its rank
+    already appeared earlier in the file.
+
+    Args:
+    file: A binary file-like object containing the CSV data.
+    workers (int): Number of worker processes, defaults to the CPU count.
+    chunk_bytes (int): Approximate size of the chunks handed to workers.
+    field_size_limit (int): Largest cell accepted, in characters. Records
+    with a larger cell are rejected.
+
+    Yields:
+    tuple: (row_number, song, error) where row_number counts the header as
+    row 1, and exactly one of song (as returned by parse_row) and error is set.
+
+    Raises:
+    ValueError: If any of the required columns is missing.
+    """
+    columns = read_header(file)
+    workers = workers or os.cpu_count() or 1
+    chunks = split_records(file, chunk_bytes)
+    songs = {}
+    ranks = {}
+    row_number = 1
+
+    for results in _parse_chunks(chunks, columns, workers, field_size_limit):
+        for song, error in results:
+            row_number += 1
+            if song is None:
+                if error is not None:
+                    yield row_number, None, error
+                continue
+
+            key = (song['name'], song['album'])
+            if key in songs:
+                yield row_number, None, f'Duplicate of the song in row {songs[key]}'
+                continue
+            if song['rank'] in ranks:
+                yield row_number, None, f"Rank {song['rank']} is already used in row {ranks[song['rank']]}"
+                continue
+            songs[key] = ranks[song['rank']] = row_number
+            yield row_number, song, None
+
+
+def _parse_chunks(chunks, columns, workers, field_size_limit):
+    """
+    Yields the parsed rows of each chunk, in order.
+
+    Files that fit in a single chunk are parsed in-process; a pool is only
+    started when there is more than one chunk to spread across workers, and
+    when this process may start children (daemonic processes, like the
+    workers of a multiprocessing pool, may not). At most two chunks per
+    worker are in flight so memory stays bounded on very large files.
+    """
+    first = next(chunks, None)
+    if first is None:
+        return
+    second = next(chunks, None)
+    if second is None or workers == 1 or multiprocessing.current_process().daemon:
+        for chunk in (first, second):
+            if chunk is not None:
+                yield parse_chunk(chunk, columns, field_size_limit)
+        for chunk in chunks:
+            yield parse_chunk(chunk, columns, field_size_limit)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(START_METHOD)) as executor:
+        in_flight = deque([
+            executor.submit(parse_chunk, first, columns, field_size_limit),
+            executor.submit(parse_chunk, second, columns, field_size_limit),
+        ])
+        for chunk in chunks:
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+            in_flight.append(executor.submit(parse_chunk, chunk, columns, field_size_limit))
+        while in_flight:
+            yield in_flight.popleft().result()
@@ -0,0 +1,103 @@
+"""
+Swagger/Redoc API documentation, built lazily.
+
+drf_yasg is only imported, and the views documented with
+swagger_auto_schema only annotated, when the docs are first requested.
+The generated schema is then kept for the life of the process. With
+API_DOCS_ENABLED set to False the docs routes are left out entirely.
+"""
+import functools
+import inspect
+
+from django.conf import settings
+from django.urls import path, re_path
+from django.views.decorators.csrf import csrf_exempt
+
+
+# (view method, swagger_auto_schema arguments) waiting for drf_yasg
+_documented = []
+
+
+def swagger_auto_schema(**kwargs):
+    """
+    Lazy version of drf_yasg.utils.swagger_auto_schema.
+
+    Arguments that need drf_yasg objects, like manual_parameters or
+    responses, are given as functions taking the drf_yasg.openapi module.
+    """
+    def decorator(view_method):
+        _documented.append((view_method, kwargs))
+        return view_method
+    return decorator
+
+
+@functools.lru_cache(maxsize=None)
+def get_schema_view_class():
+    """
+    Imports drf_yasg, annotates the documented views and returns the schema view class.
+    """
+    from drf_yasg import openapi
+    from drf_yasg.utils import swagger_auto_schema as drf_swagger_auto_schema
+    from drf_yasg.views import get_schema_view
+    from rest_framework import permissions
+    from rest_framework.response import Response
+
+    for view_method, kwargs in _documented:
+        kwargs = {
+            key: value(openapi) if inspect.isfunction(value) else value
+            for key, value in kwargs.items()
+        }
+        drf_swagger_auto_schema(**kwargs)(view_method)
+
+    schema_view = get_schema_view(
+        openapi.Info(
+            title="Songs API",
+            default_version='v1',
+            description="API for Songs",
+            # terms_of_service="URL",
+            contact=openapi.Contact(email="contact@songsapi.com"),
+            # license=openapi.License(name="BSD License"),
+        ),
+        public=True,
+        permission_classes=(permissions.AllowAny,),
+    )
+
+    class CachedSchemaView(schema_view):
+        # The schema is public, so it only depends on the renderer, version and host
+        schemas = {}
+
+        def get(self, request, version='', format=None):
+            key = (type(request.accepted_renderer), request.version or version, request.build_absolute_uri('/'))
+            if key not in self.schemas:
+                self.schemas[key] = super().get(request, version, format).data
+            return Response(self.schemas[key])
+
+    return CachedSchemaView
+
+
+@functools.lru_cache(maxsize=None)
+def get_docs_view(renderer=None):
+    schema_view = get_schema_view_class()
+    if renderer is None:
+        return schema_view.without_ui(cache_timeout=0)
+    return schema_view.with_ui(renderer, cache_timeout=0)
+
+
+def lazy_docs_view(renderer=None):
+    """
+    Returns a view that builds the docs view on its first request.
+    """
+    @csrf_exempt
+    def view(request, *args, **kwargs):
+        return get_docs_view(renderer)(request, *args, **kwargs)
+    return view
+
+
+def get_docs_urlpatterns():
+    if not settings.API_DOCS_ENABLED:
+        return []
+    return [
+        re_path(r'^swagger(?P<format>\.json|\.yaml)$', lazy_docs_view(), name='schema-json'),
+        path('swagger/', lazy_docs_view('swagger'), name='schema-swagger-ui'),
+        path('redoc/', lazy_docs_view('redoc'), name='schema-redoc'),
+    ]
@@ -0,0 +1,283 @@
+"""
+Storage of song lyrics as text files in object storage.
+
+Writes go through a write-behind queue: callers hand the lyrics over and
+return immediately, while a small thread pool writes them to disk in
+batches. Every file is written to a temporary file and renamed into place,
+so readers (and concurrent writers in other processes) never see a torn
+file. Lyrics that are still queued are served from memory, and written
+before the process exits.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import logging
+import os
+import queue
+import re
+import tarfile
+import tempfile
+import threading
+import zipfile
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def sanitize_song_name(song_name):
+    """
+    Creates a filename from the song name by making it lower case, removing
+    non-alphanumeric characters except spaces, and replacing spaces with hyphens.
+    """
+    return re.sub(r'[^\w\s-]', '', song_name.lower()).replace(' ', '-')
+
+
+def get_lyrics_dir():
+    return str(settings.LYRICS_STORAGE_DIR)
+
+
+def get_lyrics_path(song_name):
+    return os.path.join(get_lyrics_dir(), f'{sanitize_song_name(song_name)}.txt')
+
+
+def write_lyrics_file(path, lyrics_text):
+    """
+    Atomically writes lyrics to `path` through a temporary file in the same
+    directory followed by a rename.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(lyrics_text)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class LyricsWriteBehind:
+    """
+    Queue of pending lyrics writes, flushed to disk by a thread pool.
+
+    Repeated writes to the same song before it reaches the disk are
+    coalesced, only the latest lyrics are written.
+    """
+
+    def __init__(self, workers, batch_size):
+        self.batch_size = batch_size
+        self._pending = {}  # path -> lyrics text waiting to be written
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='lyrics-writer')
+        self._dispatcher = threading.Thread(target=self._dispatch, name='lyrics-dispatcher', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, song_name, lyrics_text):
+        """
+        Queues the lyrics of a song to be written to object storage.
+        """
+        path = get_lyrics_path(song_name)
+        with self._lock:
+            queued = path in self._pending
+            self._pending[path] = lyrics_text
+        if not queued:
+            self._queue.put(path)
+
+    def get_pending(self, song_name):
+        """
+        Returns the lyrics of a song that are queued but not yet on disk, or None.
+        """
+        with self._lock:
+            return self._pending.get(get_lyrics_path(song_name))
+
+    def flush(self):
+        """
+        Blocks until every queued write has reached the disk.
+        """
+        self._queue.join()
+
+    def drain(self):
+        """
+        Writes every queued lyrics file from the calling thread, without the
+        thread pool. Used at exit, once the interpreter has shut the pool down.
+        """
+        # Holding the lock keeps the dispatcher from writing the same files meanwhile
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            for path, lyrics_text in pending.items():
+                try:
+                    write_lyrics_file(path, lyrics_text)
+                except Exception:
+                    logger.exception('Could not write lyrics to %s', path)
+
+    def _dispatch(self):
+        # Group queued paths into batches and hand each batch to the pool
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._executor.submit(self._write_batch, batch)
+            except Exception:
+                # The pool refuses work once the interpreter shuts it down,
+                # the remaining lyrics are then written by this thread
+                self._write_batch(batch)
+
+    def _write_batch(self, paths):
+        for path in paths:
+            lyrics_text = None
+            try:
+                with self._lock:
+                    lyrics_text = self._pending.get(path)
+                # Unless drain() already wrote it
+                if lyrics_text is not None:
+                    write_lyrics_file(path, lyrics_text)
+            except Exception:
+                logger.exception('Could not write lyrics to %s', path)
+            finally:
+                with self._lock:
+                    current = self._pending.get(path)
+                    if current is lyrics_text:
+                        self._pending.pop(path, None)
+                    # Newer lyrics arrived while writing, write them too
+                    rewrite = current is not None and current is not lyrics_text
+                if rewrite:
+                    self._queue.put(path)
+                self._queue.task_done()
+
+
+_write_behind = None
+_write_behind_lock = threading.Lock()
+
+
+def get_write_behind():
+    """
+    Returns the process-wide lyrics write-behind queue, starting it on first use.
+    """
+    global _write_behind
+    with _write_behind_lock:
+        if _write_behind is None:
+            _write_behind = LyricsWriteBehind(
+                workers=settings.LYRICS_WRITE_WORKERS,
+                batch_size=settings.LYRICS_WRITE_BATCH_SIZE,
+            )
+            atexit.register(_write_behind.drain)
+        return _write_behind
+
+
+def save_lyrics(song_name, lyrics_text):
+    """
+    Saves the lyrics of a song to object storage, in the background.
+    """
+    get_write_behind().submit(song_name, lyrics_text)
+
+
+def save_many_lyrics(lyrics):
+    """
+    Saves the lyrics of several songs, given as (song_name, lyrics_text) pairs.
+    """
+    write_behind = get_write_behind()
+    for song_name, lyrics_text in lyrics:
+        write_behind.submit(song_name, lyrics_text)
+
+
+def read_lyrics(song_name):
+    """
+    Retrieves the lyrics for a given song.
+
+    Args:
+    song_name (str): The name of the song for which to retrieve lyrics.
+
+    Returns:
+    str: The lyrics of the song as a string, or None if the lyrics file is not found.
+    """
+    if _write_behind is not None:
+        lyrics_text = _write_behind.get_pending(song_name)
+        if lyrics_text is not None:
+            return lyrics_text
+
+    filepath = get_lyrics_path(song_name)
+    if os.path.exists(filepath):
+        with open(filepath, 'r', encoding='utf-8') as file:
+            return file.read()
+    return None
+
+
+def read_lyrics_archive(file):
+    """
+    Reads the lyrics files of a zip or tar archive.
+
+    Each member is expected to be a UTF-8 text file named after the song,
+    e.g. 'hey-jude.txt'; directories inside the archive are ignored. The
+    archive may hold at most LYRICS_ARCHIVE_MAX_FILES members, each lyrics
+    file at most LYRICS_ARCHIVE_MAX_FILE_BYTES once decompressed, and all
+    of them together at most LYRICS_ARCHIVE_MAX_BYTES.
+
+    Args:
+    file: A binary file-like object containing the archive.
+
+    Returns:
+    dict: Sanitized song name -> lyrics text.
+
+    Raises:
+    ValueError: If the file is neither a zip nor a tar archive, or exceeds
+    one of the limits.
+    """
+    reader = _LyricsArchiveReader()
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        with zipfile.ZipFile(file) as archive:
+            members = archive.infolist()
+            reader.count(len(members))
+            for member in members:
+                if not member.is_dir() and member.filename.endswith('.txt'):
+                    with archive.open(member) as member_file:
+                        reader.read(member.filename, member_file)
+        return reader.lyrics
+
+    file.seek(0)
+    try:
+        archive = tarfile.open(fileobj=file, mode='r:*')
+    except tarfile.TarError:
+        raise ValueError('Lyrics archive must be a zip or tar file')
+    with archive:
+        for member in archive:
+            reader.count(1)
+            if member.isfile() and member.name.endswith('.txt'):
+                reader.read(member.name, archive.extractfile(member))
+    return reader.lyrics
+
+
+class _LyricsArchiveReader:
+    # Reads archive members while enforcing the LYRICS_ARCHIVE_MAX_* limits,
+    # without trusting the sizes the archive declares
+
+    def __init__(self):
+        self.lyrics = {}
+        self.members = 0
+        self.total_bytes = 0
+
+    def count(self, members):
+        self.members += members
+        if self.members > settings.LYRICS_ARCHIVE_MAX_FILES:
+            raise ValueError(f'Lyrics archive has more than {settings.LYRICS_ARCHIVE_MAX_FILES} files')
+
+    def read(self, filename, member_file):
+        max_bytes = settings.LYRICS_ARCHIVE_MAX_FILE_BYTES
+        data = member_file.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            raise ValueError(f'Lyrics file {filename} is larger than {max_bytes} bytes')
+        self.total_bytes += len(data)
+        if self.total_bytes > settings.LYRICS_ARCHIVE_MAX_BYTES:
+            raise ValueError(f'Lyrics archive is larger than {settings.LYRICS_ARCHIVE_MAX_BYTES} bytes uncompressed')
+        self.lyrics[_archive_member_name(filename)] = data.decode('utf-8')
+
+
+def _archive_member_name(filename):
+    return sanitize_song_name(os.path.splitext(os.path.basename(filename))[0])
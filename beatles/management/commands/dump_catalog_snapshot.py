@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from beatles.catalog import Catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the song catalog to a snapshot file. Point CATALOG_SNAPSHOT to "
+        "the file to load it when the app starts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the snapshot file, e.g. catalog.json.gz')
+
+    def handle(self, *args, path, **options):
+        catalog = Catalog.from_db()
+        catalog.dump(path)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {len(catalog.songs)} songs to {path}'))
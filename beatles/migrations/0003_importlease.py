@@ -0,0 +1,20 @@
+# Generated by Django 4.2.9 on 2026-10-19 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beatles', '0002_song_timestamps_songchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportLease',
+            fields=[
+                ('slot', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('held_until', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
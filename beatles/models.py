@@ -52,6 +52,8 @@ class Song(models.Model):
     ug_views (IntegerField): Number of views on Ultimate Guitar.
     ug_favourites (IntegerField): Number of times favorited on Ultimate Guitar.
     lyrics (JSONField): The lyrics of the song, stored in JSON format.
+    created_at (DateTimeField): When the song was added.
+    updated_at (DateTimeField): When the song, or its writers or singers, last changed.
     """
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=200)
@@ -67,6 +69,8 @@ class Song(models.Model):
     ug_views = models.IntegerField()
     ug_favourites = models.IntegerField()
     lyrics = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -77,6 +81,55 @@ class Song(models.Model):
             models.Index(fields=['id']),
             models.Index(fields=['rank']),
             models.Index(fields=['year_released']),
+            models.Index(fields=['created_at']),
+            models.Index(fields=['updated_at']),
         ]
 
 
+class SongChange(models.Model):
+    """
+    Append-only log of the changes made to songs, read by the change feed.
+
+    The id is the cursor of the feed: clients pass the last id they have
+    seen to get the changes made after it.
+
+    Fields:
+    song_id (IntegerField): The changed song. Not a foreign key, so the
+    changes of deleted songs are kept.
+    action (CharField): Whether the song was created, updated or deleted.
+    changed_at (DateTimeField): When the change was written, just after it
+    was committed (see changelog.py).
+    """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTIONS = [
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (DELETED, 'Deleted'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    song_id = models.IntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.action} song {self.song_id}'
+
+
+class ImportLease(models.Model):
+    """
+    One of the CSV_IMPORT_MAX_CONCURRENT slots for running CSV imports,
+    taken and released by throttling.ImportSlot.
+
+    Fields:
+    slot (PositiveSmallIntegerField): The number of the slot.
+    held_until (DateTimeField): When the slot is freed if the import holding
+    it never releases it, null while the slot is free.
+    """
+    slot = models.PositiveSmallIntegerField(primary_key=True)
+    held_until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'Import slot {self.slot}'
@@ -1,6 +1,8 @@
 from rest_framework import serializers
-from .models import Album, SongWriter, Singer, Song
-import re, os, json
+from django.db import transaction
+from .models import Album, SongWriter, Singer, Song, SongChange
+from .changelog import pause_change_signals, record_changes
+from .lyrics_storage import save_lyrics
 
 
 class AlbumSerializer(serializers.ModelSerializer):
@@ -44,28 +46,30 @@ class SongSerializer(serializers.ModelSerializer):
             'id', 'name', 'album', 'writers', 'singers', 'rank',
             'year_released', 'song_time', 'spotify_streams',
             'rolling_stone_ranking', 'nme_ranking', 'ug_views',
-            'ug_favourites', 'lyrics'
+            'ug_favourites', 'lyrics', 'created_at', 'updated_at'
         ]
 
     def create(self, validated_data):
         """
         Custom create method for Song model. Manages the creation of related
-        Album, SongWriter, and Singer instances.
+        Album, SongWriter, and Singer instances, and records a single change
+        for the new song in the change log.
         """
         writers_data = validated_data.pop('writers', [])
         singers_data = validated_data.pop('singers', [])
         album_data = validated_data.pop('album', None)
 
-        album, _ = Album.objects.get_or_create(**album_data) if album_data else (None, False)
-        song = Song.objects.create(**validated_data, album=album)
+        with pause_change_signals():
+            album = self.get_or_create(Album, album_data['title']) if album_data else None
+            song = Song.objects.create(**validated_data, album=album)
 
-        for writer_data in writers_data:
-            writer, _ = SongWriter.objects.get_or_create(**writer_data)
-            song.writers.add(writer)
+            for writer_data in writers_data:
+                song.writers.add(self.get_or_create(SongWriter, writer_data['name']))
 
-        for singer_data in singers_data:
-            singer, _ = Singer.objects.get_or_create(**singer_data)
-            song.singers.add(singer)
+            for singer_data in singers_data:
+                song.singers.add(self.get_or_create(Singer, singer_data['name']))
+
+        record_changes([song.id], SongChange.CREATED)
 
         # Process lyrics data
         if 'lyrics' in validated_data:
@@ -80,16 +84,20 @@ class SongSerializer(serializers.ModelSerializer):
 
         return song
 
-    def save_lyrics_to_object_storage(self, song_name, lyrics_text):
+    def get_or_create(self, model, name):
         """
-        Saves lyrics to a text file in the specified directory (or object storage)
+        Gets or creates an Album (by title), SongWriter or Singer (by name).
         """
-        sanitized_song_name = re.sub(r'[^\w\s-]', '', song_name.lower()).replace(' ', '-')
-        views_dir = os.path.dirname(os.path.abspath(__file__))
-        lyrics_path = os.path.join(views_dir, 'object_storage/lyrics', f'{sanitized_song_name}.txt')
+        field = 'title' if model is Album else 'name'
+        instance, _ = model.objects.get_or_create(**{field: name})
+        return instance
 
-        with open(lyrics_path, 'w', encoding='utf-8') as file:
-            file.write(lyrics_text)
+    def save_lyrics_to_object_storage(self, song_name, lyrics_text):
+        """
+        Saves lyrics to a text file in object storage. The write is queued
+        once the song is committed, so the request does not wait on the disk.
+        """
+        transaction.on_commit(lambda: save_lyrics(song_name, lyrics_text))
 
 
 class LimitedSongSerializer(serializers.ModelSerializer):
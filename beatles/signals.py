@@ -0,0 +1,71 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .catalog import invalidate_catalog
+from .changelog import change_signals_paused, record_changes
+from .models import Album, Singer, Song, SongChange, SongWriter
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=SongWriter)
+@receiver(post_save, sender=Singer)
+@receiver(post_delete, sender=Song)
+@receiver(post_delete, sender=Album)
+@receiver(post_delete, sender=SongWriter)
+@receiver(post_delete, sender=Singer)
+@receiver(m2m_changed, sender=Song.writers.through)
+@receiver(m2m_changed, sender=Song.singers.through)
+def catalog_changed(sender, **kwargs):
+    # Any change to the catalog makes the in-process snapshot stale
+    invalidate_catalog()
+
+
+@receiver(post_save, sender=Song)
+def song_saved(sender, instance, created, **kwargs):
+    if not change_signals_paused():
+        record_changes([instance.pk], SongChange.CREATED if created else SongChange.UPDATED)
+
+
+@receiver(post_delete, sender=Song)
+def song_deleted(sender, instance, **kwargs):
+    if not change_signals_paused():
+        record_changes([instance.pk], SongChange.DELETED)
+
+
+# Song field linking to each related model
+SONG_RELATIONS = {Album: 'album', SongWriter: 'writers', Singer: 'singers'}
+
+
+def songs_updated(song_ids):
+    Song.objects.filter(pk__in=song_ids).update(updated_at=timezone.now())
+    record_changes(song_ids, SongChange.UPDATED)
+
+
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=SongWriter)
+@receiver(post_save, sender=Singer)
+def song_relation_saved(sender, instance, created, **kwargs):
+    # Renaming an album, writer or singer changes how its songs are listed
+    if created or change_signals_paused():
+        return
+    songs = Song.objects.filter(**{SONG_RELATIONS[sender]: instance})
+    songs_updated(list(songs.values_list('pk', flat=True)))
+
+
+@receiver(m2m_changed, sender=Song.writers.through)
+@receiver(m2m_changed, sender=Song.singers.through)
+def song_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if change_signals_paused():
+        return
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            songs_updated([instance.pk])
+    elif action == 'pre_clear':
+        # Clearing from the writer/singer side does not tell which songs were linked
+        instance._cleared_song_ids = list(instance.song_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        songs_updated(instance.__dict__.pop('_cleared_song_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        songs_updated(list(pk_set))
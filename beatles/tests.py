@@ -1,12 +1,67 @@
+import base64
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import io
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+import zipfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
-from django.contrib.auth.models import User
-from .models import Song, Album, Singer, SongWriter
-import os
-import json
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from . import catalog
+from . import lyrics_storage
+from .csv_parser import iter_song_rows, split_records
+from .docs import get_docs_urlpatterns, get_schema_view_class
+from .lyrics_storage import LyricsWriteBehind, get_lyrics_dir, get_lyrics_path, get_write_behind, read_lyrics
+from .models import Song, Album, Singer, SongWriter, SongChange, ImportLease
+from .throttling import ImportSlot, ImportsBusy, TokenBucketThrottle
+from .views import CSVUploadView, get_report_path
+
 
-class SongAPITestCase(APITestCase):
+class TemporaryStorageMixin:
+    # Each test class gets its own lyrics and reports directories, and fresh
+    # throttle buckets, so the test classes can run in parallel
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        storage = tempfile.TemporaryDirectory(prefix='beatles-tests-')
+        cls.addClassCleanup(storage.cleanup)
+        lyrics_dir = os.path.join(storage.name, 'lyrics')
+        os.makedirs(lyrics_dir)
+
+        storage_settings = override_settings(
+            LYRICS_STORAGE_DIR=lyrics_dir,
+            IMPORT_REPORTS_DIR=os.path.join(storage.name, 'import_reports'),
+        )
+        storage_settings.enable()
+        cls.addClassCleanup(storage_settings.disable)
+        # Lyrics still queued must be written before the directory goes away
+        cls.addClassCleanup(lambda: lyrics_storage._write_behind and lyrics_storage._write_behind.flush())
+
+        caches[settings.THROTTLE_CACHE].clear()
+
+
+class SongFixtureMixin(TemporaryStorageMixin):
+    # A user, and a song with its album, writers, singers and lyrics file
 
     def setUp(self):
         # Create a user and anbum, writers and singers for testing
@@ -24,8 +79,7 @@ class SongAPITestCase(APITestCase):
         self.lyrics_content = "Sample lyrics for testing."
 
         # Create a dummy lyrics file
-        views_dir = os.path.dirname(os.path.abspath(__file__))
-        self.filepath = os.path.join(views_dir, 'object_storage/lyrics', self.lyrics_file)
+        self.filepath = os.path.join(get_lyrics_dir(), self.lyrics_file)
         with open(self.filepath, 'w', encoding='utf-8') as file:
             file.write(self.lyrics_content)
 
@@ -47,6 +101,12 @@ class SongAPITestCase(APITestCase):
         self.song.writers.add(self.writer1)
         self.song.singers.add(self.singer1)
 
+    def tearDown(self):
+        # Clean up the dummy lyrics file after tests
+        os.remove(self.filepath)
+
+
+class SongAPITestCase(SongFixtureMixin, APITestCase):
 
     def test_song_list_authenticated(self):
         # Authenticate the user
@@ -110,10 +170,6 @@ class SongAPITestCase(APITestCase):
         # The API should return a 401 Unauthorized status code
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
-    def tearDown(self):
-        # Clean up the dummy lyrics file after tests
-        os.remove(self.filepath)
-
     def test_get_lyrics_authenticated(self):
         # Authenticate the user
         login_successful = self.client.login(username='evident', password='dev_interview')
@@ -143,4 +199,712 @@ class SongAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
+CSV_HEADER = (
+    'Song Name,Album,Song Writer,Singer,Rank,Year Released,Song Time,Spotify Streams,'
+    'Rolling Stone 100 Greatest Beatles Songs Ranking,NME Top 50 Beatles Songs Ranking,'
+    'UG Views,UG Favourites\n'
+)
+
+
+def make_csv(count):
+    # Build a CSV with quoted multiline writer/singer cells on every record
+    lines = [CSV_HEADER]
+    for i in range(count):
+        lines.append(
+            f'Song {i},Album {i % 3},"Lennon\nMcCartney","Lennon\nMcCartney",{i + 1},1965,'
+            f'02:{i % 60:02d},"1,{i:03d},000",{i + 1},{"" if i % 2 else i + 1},{i * 10},{i}\n'
+        )
+    return ''.join(lines).encode('utf-8')
+
+
+def process_pool(test):
+    # Parsing falls back to a single process in daemonic processes, like the
+    # workers of `manage.py test --parallel`: skip rather than pass without a pool
+    if multiprocessing.current_process().daemon:
+        test.skipTest('daemonic processes can not start a process pool')
+    return mock.patch('beatles.csv_parser.ProcessPoolExecutor', wraps=ProcessPoolExecutor)
+
+
+class CSVParserTestCase(TemporaryStorageMixin, SimpleTestCase):
+
+    def test_split_records_respects_quoted_newlines(self):
+        data = make_csv(50)
+        body = io.BytesIO(data)
+        body.readline()  # skip the header
+
+        chunks = list(split_records(body, chunk_bytes=64))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), data[len(CSV_HEADER):])
+        for chunk in chunks:
+            # Every chunk holds whole records, so its quotes are balanced
+            self.assertEqual(chunk.count(b'"') % 2, 0)
+
+    def test_parallel_parse_matches_serial(self):
+        data = make_csv(200)
+        serial = list(iter_song_rows(io.BytesIO(data), workers=1))
+        with process_pool(self) as pool:
+            parallel = list(iter_song_rows(io.BytesIO(data), workers=2, chunk_bytes=512))
+        pool.assert_called_once_with(max_workers=2, mp_context=mock.ANY)
+        self.assertNotEqual(pool.call_args.kwargs['mp_context'].get_start_method(), 'fork')
+
+        self.assertEqual(len(serial), 200)
+        self.assertEqual(parallel, serial)
+        row_number, song, error = serial[1]
+        self.assertEqual(row_number, 3)
+        self.assertIsNone(error)
+        self.assertEqual(song['writers'], ['Lennon', 'McCartney'])
+        self.assertEqual(song['spotify_streams'], 1001000)
+        self.assertIsNone(song['nme_ranking'])
+
+    def test_duplicate_songs_are_rejected(self):
+        data = make_csv(5) + make_csv(5)[len(CSV_HEADER):]
+        rows = list(iter_song_rows(io.BytesIO(data), workers=1))
+        self.assertEqual([song['name'] for _, song, _ in rows if song], [f'Song {i}' for i in range(5)])
+        self.assertEqual(rows[5], (7, None, 'Duplicate of the song in row 2'))
+
+    def test_invalid_rows_are_rejected(self):
+        data = make_csv(3).decode('utf-8').splitlines(keepends=True)
+        data = ''.join(data) + (
+            'Bad Year,Album,Lennon,Lennon,10,19x5,02:00,1,1,,1,1\n'
+            'Bad Rank,Album,Lennon,Lennon,0,1965,02:00,1,1,,1,1\n'
+            'Same Rank,Album,Lennon,Lennon,1,1965,02:00,1,1,,1,1\n'
+            'Bad Time,Album,Lennon,Lennon,11,1965,long,1,1,,1,1\n'
+            'No Singer,Album,Lennon,,12,1965,02:00,1,1,,1,1\n'
+            'Short,Album,Lennon\n'
+        )
+        rows = list(iter_song_rows(io.BytesIO(data.encode('utf-8')), workers=1))
+        errors = [(row_number, error) for row_number, _, error in rows if error]
+
+        self.assertEqual(len(rows) - len(errors), 3)
+        self.assertEqual([row_number for row_number, _ in errors], [5, 6, 7, 8, 9, 10])
+        self.assertIn("'Year Released' is not an integer", errors[0][1])
+        self.assertIn("'Rank' must be between 1", errors[1][1])
+        self.assertEqual(errors[2][1], 'Rank 1 is already used in row 2')
+        self.assertIn("'Song Time'", errors[3][1])
+        self.assertEqual(errors[4][1], "'Singer' is empty")
+        self.assertEqual(errors[5][1], 'Expected 12 columns, found 3')
+
+    def test_malformed_records_are_rejected(self):
+        # The records after a cell over the limit, even a multiline one, are still read
+        long_name = 'Long\n' + 'x' * 200
+        data = make_csv(2) + (
+            f'"{long_name}",Album,Lennon,Lennon,10,1965,02:00,1,1,,1,1\n'
+            'After,Album,Lennon,Lennon,11,1965,02:00,1,1,,1,1\n'
+        ).encode('utf-8')
+        rows = list(iter_song_rows(io.BytesIO(data), workers=1, field_size_limit=100))
+        self.assertEqual([row_number for row_number, song, _ in rows if song], [2, 3, 5])
+        self.assertEqual(rows[2], (4, None, 'Malformed CSV record: field larger than field limit (100)'))
+
+        data = make_csv(1) + b'Open Quote,Album,"Lennon,Lennon,2,1965,02:00,1,1,,1,1\n'
+        rows = list(iter_song_rows(io.BytesIO(data), workers=1))
+        self.assertEqual(rows[1], (3, None, 'Malformed CSV record: unterminated quoted field'))
+
+    def test_missing_columns(self):
+        with self.assertRaisesMessage(ValueError, 'Missing required columns: Singer'):
+            list(iter_song_rows(io.BytesIO(CSV_HEADER.replace(',Singer', '').encode('utf-8'))))
+
+
+class CSVUploadTestCase(TemporaryStorageMixin, APITestCase):
+
+    @override_settings(CSV_IMPORT_WORKERS=2, CSV_IMPORT_CHUNK_BYTES=256, CSV_IMPORT_BATCH_SIZE=7)
+    def test_upload_csv(self):
+        upload = SimpleUploadedFile('songs.csv', make_csv(20), content_type='text/csv')
+        with process_pool(self) as pool:
+            response = self.client.post(reverse('Upload songs csv'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        pool.assert_called_once_with(max_workers=2, mp_context=mock.ANY)
+        self.assertNotEqual(pool.call_args.kwargs['mp_context'].get_start_method(), 'fork')
+
+        self.assertEqual(Song.objects.count(), 20)
+        self.assertEqual(Album.objects.count(), 3)
+        self.assertEqual(SongWriter.objects.count(), 2)
+        song = Song.objects.get(name='Song 4')
+        self.assertEqual(song.nme_ranking, 5)
+        self.assertEqual(sorted(song.singers.values_list('name', flat=True)), ['Lennon', 'McCartney'])
+
+    def test_upload_csv_queries_do_not_grow_with_rows(self):
+        # Songs are written in batches, so a bigger file does not mean more
+        # queries (as long as SQLite does not split the inserts itself)
+        query_counts = []
+        for count in (5, 50):
+            for model in (Song, Album, SongWriter, Singer):
+                model.objects.all().delete()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.upload(make_csv(count))
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_upload_csv_parses_outside_the_transaction(self):
+        # The upload is parsed before the import transaction is opened
+        atomic_depth = len(connection.atomic_blocks)
+        parse_depths = []
+
+        def parse(*args, **kwargs):
+            for row in iter_song_rows(*args, **kwargs):
+                parse_depths.append(len(connection.atomic_blocks))
+                yield row
+
+        with mock.patch('beatles.views.iter_song_rows', parse), \
+                mock.patch.object(CSVUploadView, 'save_songs', autospec=True) as save_songs:
+            save_songs.side_effect = lambda view, rows, lookups: self.assertEqual(
+                len(connection.atomic_blocks), atomic_depth + 1
+            )
+            response = self.upload(make_csv(20))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(parse_depths, [atomic_depth] * 20)
+        save_songs.assert_called()
+
+    def upload(self, data, query=''):
+        upload = SimpleUploadedFile('songs.csv', data, content_type='text/csv')
+        return self.client.post(reverse('Upload songs csv') + query, {'file': upload}, format='multipart')
+
+    def test_upload_csv_with_rejected_rows(self):
+        data = make_csv(3) + b'Bad Rank,Album,Lennon,Lennon,x,1965,02:00,1,1,,1,1\n'
+        response = self.upload(data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['valid'], 3)
+        self.assertEqual(response.data['rejected'], 1)
+        self.assertEqual(Song.objects.count(), 3)
+
+        report = self.client.get(response.data['report'])
+        self.assertEqual(report.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            b''.join(report.streaming_content).decode('utf-8').splitlines(),
+            ['Row,Reason', '5,\'Rank\' is not an integer: \'x\''],
+        )
+
+    def test_import_report_belongs_to_uploader(self):
+        for username in ('evident', 'other'):
+            User.objects.create_user(username=username, password='dev_interview')
+        self.client.login(username='evident', password='dev_interview')
+        response = self.upload(make_csv(1) + b'Bad Rank,Album,Lennon,Lennon,x,1965,02:00,1,1,,1,1\n')
+        report_url = response.data['report']
+        self.assertEqual(self.client.get(report_url).status_code, status.HTTP_200_OK)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(report_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.client.login(username='other', password='dev_interview')
+        self.assertEqual(self.client.get(report_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_import_reports_expire(self):
+        bad_row = b'Bad Rank,Album,Lennon,Lennon,x,1965,02:00,1,1,,1,1\n'
+        report_url = self.upload(make_csv(1) + bad_row).data['report']
+        report_path = get_report_path(report_url.rstrip('/').rsplit('/', 1)[-1], 'anonymous')
+
+        # A day later the report is gone, and deleted by the next upload
+        with override_settings(IMPORT_REPORT_TTL=-1):
+            self.assertEqual(self.client.get(report_url).status_code, status.HTTP_404_NOT_FOUND)
+            self.upload(make_csv(1) + bad_row)
+        self.assertFalse(os.path.exists(report_path))
+
+    def test_upload_csv_dry_run(self):
+        # Dry runs neither take an import slot nor check the existing songs
+        with self.assertNumQueries(0):
+            response = self.upload(make_csv(10), query='?dry_run=true')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['valid'], 10)
+        self.assertIsNone(response.data['report'])
+        self.assertEqual(Song.objects.count(), 0)
+
+    def test_upload_csv_rejects_existing_songs(self):
+        self.upload(make_csv(2))
+        # Song 1 is already imported, and rank 2 is taken by it
+        data = (CSV_HEADER + (
+            'Song 1,Album 1,Lennon,Lennon,50,1965,02:00,1,1,,1,1\n'
+            'Other Song,Album 0,Lennon,Lennon,2,1965,02:00,1,1,,1,1\n'
+            'New Song,Album 0,Lennon,Lennon,3,1965,02:00,1,1,,1,1\n'
+        )).encode('utf-8')
+
+        for query in ('?dry_run=true&check_existing=true', ''):
+            response = self.upload(data, query=query)
+            self.assertEqual(response.data['valid'], 1)
+            self.assertEqual(response.data['rejected'], 2)
+        self.assertEqual(sorted(Song.objects.values_list('rank', flat=True)), [1, 2, 3])
+
+        report = self.client.get(response.data['report'])
+        self.assertEqual(b''.join(report.streaming_content).decode('utf-8').splitlines(), [
+            'Row,Reason', '2,The song already exists', '3,Rank 2 is already used by an existing song',
+        ])
+
+    def test_upload_csv_missing_columns(self):
+        response = self.upload(b'Song Name,Album\nHelp,Help\n')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Missing required columns', response.data['message'])
+
+    def test_upload_csv_with_lyrics(self):
+        data = CSV_HEADER.replace('\n', ',Lyrics\n') + (
+            'Lyrics Column Song,Album,Lennon,Lennon,1,1965,02:00,1,1,,1,1,"Line one\nLine two"\n'
+            'Lyrics Archive Song,Album,Lennon,Lennon,2,1965,02:00,1,1,,1,1,\n'
+        )
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('lyrics/lyrics-archive-song.txt', 'From the archive')
+        archive.seek(0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('Upload songs csv'), {
+                'file': SimpleUploadedFile('songs.csv', data.encode('utf-8'), content_type='text/csv'),
+                'lyrics_archive': SimpleUploadedFile('lyrics.zip', archive.read(), content_type='application/zip'),
+            }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['lyrics'], 2)
+
+        get_write_behind().flush()
+        with open(get_lyrics_path('Lyrics Column Song'), encoding='utf-8') as file:
+            self.assertEqual(file.read(), 'Line one\nLine two')
+        with open(get_lyrics_path('Lyrics Archive Song'), encoding='utf-8') as file:
+            self.assertEqual(file.read(), 'From the archive')
+
+    def test_upload_csv_with_long_lyrics(self):
+        # Lyrics cells are not held to csv's default 128 KiB field size limit
+        lyrics_text = 'Na na na\n' * 20000
+        data = CSV_HEADER.replace('\n', ',Lyrics\n') + (
+            f'Hey Jude,Album,Lennon,Lennon,1,1968,07:11,1,1,,1,1,"{lyrics_text}"\n'
+        )
+        response = self.upload(data.encode('utf-8'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['valid'], response.data['lyrics']), (1, 1))
+
+    def test_upload_csv_invalid_lyrics_archive(self):
+        response = self.client.post(reverse('Upload songs csv'), {
+            'file': SimpleUploadedFile('songs.csv', make_csv(1), content_type='text/csv'),
+            'lyrics_archive': SimpleUploadedFile('lyrics.zip', b'not an archive'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Song.objects.count(), 0)
+
+
+    @override_settings(LYRICS_ARCHIVE_MAX_FILES=2, LYRICS_ARCHIVE_MAX_FILE_BYTES=1000, LYRICS_ARCHIVE_MAX_BYTES=1500)
+    def test_upload_csv_lyrics_archive_limits(self):
+        for files, message in [
+            ({'a.txt': 'a' * 1001}, 'Lyrics file a.txt is larger than 1000 bytes'),
+            ({'a.txt': 'a' * 1000, 'b.txt': 'b' * 1000}, 'Lyrics archive is larger than 1500 bytes uncompressed'),
+            ({'a.txt': 'a', 'b.txt': 'b', 'c.txt': 'c'}, 'Lyrics archive has more than 2 files'),
+        ]:
+            archive = io.BytesIO()
+            with zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+                for name, lyrics_text in files.items():
+                    zip_file.writestr(name, lyrics_text)
+            response = self.client.post(reverse('Upload songs csv'), {
+                'file': SimpleUploadedFile('songs.csv', make_csv(1), content_type='text/csv'),
+                'lyrics_archive': SimpleUploadedFile('lyrics.zip', archive.getvalue()),
+            }, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data['message'], message)
+        self.assertEqual(Song.objects.count(), 0)
+
+
+class LyricsWriteBehindTestCase(TemporaryStorageMixin, SimpleTestCase):
+
+    def setUp(self):
+        self.song_name = 'Write Behind Song'
+
+    def test_concurrent_writes_keep_latest_lyrics(self):
+        write_behind = get_write_behind()
+        for i in range(100):
+            write_behind.submit(self.song_name, f'Version {i}')
+        # Queued lyrics are readable before they reach the disk
+        self.assertIn(read_lyrics(self.song_name), [f'Version {i}' for i in range(100)])
+
+        write_behind.flush()
+        self.assertIsNone(write_behind.get_pending(self.song_name))
+        self.assertEqual(read_lyrics(self.song_name), 'Version 99')
+        # No temporary files are left behind
+        lyrics_dir = os.path.dirname(get_lyrics_path(self.song_name))
+        self.assertFalse([name for name in os.listdir(lyrics_dir) if name.endswith('.tmp')])
+
+
+    def test_drain_without_thread_pool(self):
+        # At exit the thread pool is shut down, the exiting thread writes the rest
+        write_behind = LyricsWriteBehind(workers=1, batch_size=8)
+        write_behind._executor.shutdown()
+        for i in range(50):
+            write_behind.submit(f'Drained Song {i}', f'Lyrics {i}')
+        write_behind.drain()
+
+        self.assertIsNone(write_behind.get_pending('Drained Song 49'))
+        for i in range(50):
+            with open(get_lyrics_path(f'Drained Song {i}'), encoding='utf-8') as file:
+                self.assertEqual(file.read(), f'Lyrics {i}')
+
+    def test_pending_writes_are_flushed_at_exit(self):
+        # A process exiting with lyrics still queued writes them all, and exits
+        script = (
+            'import sys, time\n'
+            'from django.conf import settings\n'
+            'settings.LYRICS_STORAGE_DIR = sys.argv[1]\n'
+            'from beatles import lyrics_storage\n'
+            'write_lyrics_file = lyrics_storage.write_lyrics_file\n'
+            'def slow_write(path, lyrics_text):\n'
+            '    time.sleep(0.01)\n'
+            '    write_lyrics_file(path, lyrics_text)\n'
+            'lyrics_storage.write_lyrics_file = slow_write\n'
+            'lyrics_storage.save_many_lyrics((f"Song {i}", "Lyrics") for i in range(200))\n'
+        )
+        lyrics_dir = get_lyrics_dir()
+        result = subprocess.run(
+            [sys.executable, '-c', script, lyrics_dir],
+            cwd=settings.BASE_DIR, env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'media_company.settings_test'},
+            capture_output=True, text=True, timeout=20,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stderr, '')
+        self.assertEqual(len([name for name in os.listdir(lyrics_dir) if name.startswith('song-')]), 200)
+
+
+@override_settings(CATALOG_SNAPSHOT='db')
+class CatalogTestCase(SongAPITestCase):
+    # Runs the song API tests again with the in-process catalog enabled
+
+    def setUp(self):
+        super().setUp()
+        catalog.warm_start()
+        self.addCleanup(catalog.invalidate_catalog)
+
+    def test_song_list_served_from_catalog(self):
+        self.client.login(username='evident', password='dev_interview')
+        with self.assertNumQueries(2):  # session and user lookups only
+            response = self.client.get(reverse('song-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['name'], 'Test Song')
+        self.assertEqual(response.data[0]['writers'], [{'name': 'John Doe'}])
+
+        self.client.logout()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('song-list'))
+        self.assertEqual(response.data, [
+            {'name': 'Test Song', 'album': {'title': 'Test Album'}, 'writers': [{'name': 'John Doe'}], 'rank': 1}
+        ])
+
+    def test_catalog_reloads_after_changes(self):
+        Song.objects.create(
+            name='Another Song', album=self.album, rank=2, year_released=2020, song_time='03:30',
+            spotify_streams=1, rolling_stone_ranking=3, ug_views=1, ug_favourites=1,
+        )
+        response = self.client.get(reverse('song-list'))
+        self.assertEqual([song['name'] for song in response.data], ['Test Song', 'Another Song'])
+
+    def test_lyrics_by_name_from_catalog(self):
+        self.client.login(username='evident', password='dev_interview')
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('song-lyrics', args=['test-song']))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['lyrics'], self.lyrics_content)
+
+    def test_snapshot_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.json.gz')
+            call_command('dump_catalog_snapshot', path, stdout=io.StringIO())
+
+            catalog.invalidate_catalog()
+            with self.settings(CATALOG_SNAPSHOT=path), self.assertNumQueries(0):
+                catalog.warm_start()
+                loaded = catalog.get_catalog()
+
+        self.assertEqual(loaded.find_song(str(self.song.id))['name'], 'Test Song')
+
+    def test_catalog_dropped_while_loading_is_not_kept(self):
+        catalog.invalidate_catalog()
+        from_db = catalog.Catalog.from_db
+
+        def load_and_drop():
+            # Another thread commits a change while this one reads the catalog
+            loaded = from_db()
+            catalog.invalidate_catalog()
+            return loaded
+
+        with mock.patch.object(catalog.Catalog, 'from_db', side_effect=load_and_drop):
+            self.assertIsNone(catalog.get_catalog())
+            self.assertIsNone(catalog.get_catalog(reload=False))
+            catalog.warm_start()
+            self.assertIsNone(catalog.get_catalog(reload=False))
+
+        # The next read loads it again
+        self.assertIsNotNone(catalog.get_catalog())
+
+    def test_out_of_date_snapshot_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.json.gz')
+            songs = catalog.Catalog.from_db().songs
+            catalog.Catalog(songs, read_at=time.time() - settings.CATALOG_CACHE_TTL - 1).dump(path)
+            Song.objects.create(
+                name='Newer Song', album=self.album, rank=2, year_released=2020, song_time='03:30',
+                spotify_streams=1, rolling_stone_ranking=3, ug_views=1, ug_favourites=1,
+            )
+
+            catalog.invalidate_catalog()
+            with self.settings(CATALOG_SNAPSHOT=path):
+                catalog.warm_start()
+                loaded = catalog.get_catalog(reload=False)
+
+        # The catalog was loaded from the database instead
+        self.assertIsNotNone(loaded)
+        self.assertEqual(loaded.find_song('newer-song')['rank'], 2)
+
+    def test_writes_do_not_trust_catalog_ids(self):
+        # Another process deletes a writer, this process does not notice
+        with mock.patch('beatles.signals.invalidate_catalog'):
+            self.writer2.delete()
+        self.assertIsNotNone(catalog.get_catalog(reload=False))
+
+        data = CSV_HEADER + 'Imported Song,Test Album,Jane Smith,Alice Cooper,2,1965,02:00,1,1,,1,1\n'
+        upload = SimpleUploadedFile('songs.csv', data.encode('utf-8'), content_type='text/csv')
+        response = self.client.post(reverse('Upload songs csv'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        song = Song.objects.get(name='Imported Song')
+        self.assertEqual(list(song.writers.values_list('name', flat=True)), ['Jane Smith'])
+        self.assertNotEqual(song.writers.get().pk, self.writer2.pk)
+
+
+class APIDocsTestCase(TemporaryStorageMixin, APITestCase):
+
+    def test_swagger_schema(self):
+        response = self.client.get(reverse('schema-json', args=['.json']))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        schema = json.loads(response.content)
+        self.assertIn('/songs/', schema['paths'])
+        # Parameters declared lazily on the views are part of the schema
+        upload_parameters = schema['paths']['/upload_songs_csv/']['post']['parameters']
+        self.assertIn('dry_run', [parameter['name'] for parameter in upload_parameters])
+
+        # The schema is only generated once
+        generator_class = get_schema_view_class().generator_class
+        with mock.patch.object(generator_class, 'get_schema') as get_schema:
+            response = self.client.get(reverse('schema-json', args=['.json']))
+        get_schema.assert_not_called()
+        self.assertEqual(json.loads(response.content), schema)
+
+    def test_swagger_ui(self):
+        response = self.client.get(reverse('schema-swagger-ui'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(API_DOCS_ENABLED=False)
+    def test_docs_disabled(self):
+        self.assertEqual(get_docs_urlpatterns(), [])
+
+
+def throttle_rates(**rates):
+    # REST_FRAMEWORK settings with some throttle rates replaced
+    return {
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], **rates},
+    }
+
+
+class ThrottlingTestCase(TemporaryStorageMixin, APITestCase):
+
+    def setUp(self):
+        caches[settings.THROTTLE_CACHE].clear()
+        self.addCleanup(caches[settings.THROTTLE_CACHE].clear)
+        self.user = User.objects.create(username='evident')
+        self.user.set_password('dev_interview')
+        self.user.save()
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(ip='2/min'))
+    def test_ip_throttle_sheds_load_before_authentication(self):
+        credentials = base64.b64encode(b'evident:dev_interview').decode('ascii')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Basic {credentials}')
+        for _ in range(2):
+            self.assertEqual(self.client.get(reverse('song-list')).status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('song-list'))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '30')
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(ip='2/min'))
+    def test_forwarded_for_header_is_not_trusted(self):
+        # Clients can not get a new bucket by sending their own X-Forwarded-For
+        for i in range(2):
+            response = self.client.get(reverse('song-list'), HTTP_X_FORWARDED_FOR=f'10.0.0.{i}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('song-list'), HTTP_X_FORWARDED_FOR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(anon_songs='1/min'))
+    def test_anonymous_song_list_is_stricter(self):
+        self.assertEqual(self.client.get(reverse('song-list')).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(reverse('song-list')).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        self.client.login(username='evident', password='dev_interview')
+        self.assertEqual(self.client.get(reverse('song-list')).status_code, status.HTTP_200_OK)
+
+    @override_settings(CSV_IMPORT_MAX_CONCURRENT=0, CSV_IMPORT_RETRY_AFTER=15)
+    def test_import_concurrency_cap(self):
+        upload = SimpleUploadedFile('songs.csv', make_csv(1), content_type='text/csv')
+        response = self.client.post(reverse('Upload songs csv'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '15')
+        self.assertEqual(Song.objects.count(), 0)
+
+    def test_import_slot_is_released(self):
+        upload = SimpleUploadedFile('songs.csv', make_csv(1), content_type='text/csv')
+        response = self.client.post(reverse('Upload songs csv'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(ImportLease.objects.filter(held_until__isnull=False).exists())
+
+    @override_settings(CSV_IMPORT_MAX_CONCURRENT=1)
+    def test_import_slot_held_by_another_process(self):
+        # Slots are shared through the database, and freed once they time out
+        ImportLease.objects.create(slot=0, held_until=timezone.now() + timedelta(minutes=1))
+        upload = SimpleUploadedFile('songs.csv', make_csv(1), content_type='text/csv')
+        response = self.client.post(reverse('Upload songs csv'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        ImportLease.objects.update(held_until=timezone.now() - timedelta(seconds=1))
+        upload = SimpleUploadedFile('songs.csv', make_csv(1), content_type='text/csv')
+        response = self.client.post(reverse('Upload songs csv'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_import_slot_is_taken_once(self):
+        # Two processes seeing the same free slot: only the first update takes it
+        with override_settings(CSV_IMPORT_MAX_CONCURRENT=1):
+            with mock.patch.object(QuerySet, 'values_list', return_value=[0]):
+                first = ImportSlot().__enter__()
+                with self.assertRaises(ImportsBusy):
+                    ImportSlot().__enter__()
+            first.__exit__(None, None, None)
+
+    def test_token_bucket_refills(self):
+        class Throttle(TokenBucketThrottle):
+            rate = '2/min'
+
+            def get_cache_key(self, request, view):
+                return 'throttle_test'
+
+        now = 1000.0
+        with mock.patch.object(Throttle, 'timer', lambda self: now):
+            throttle = Throttle()
+            self.assertTrue(throttle.allow_request(None, None))
+            self.assertTrue(throttle.allow_request(None, None))
+            self.assertFalse(throttle.allow_request(None, None))
+            self.assertEqual(throttle.wait(), 30)
+
+            # One token is back after half a minute
+            now += 30
+            self.assertTrue(throttle.allow_request(None, None))
+            self.assertFalse(throttle.allow_request(None, None))
+
+
+@override_settings(SONG_CHANGES_SAFETY_LAG=0)
+class SongChangesTestCase(SongFixtureMixin, APITransactionTestCase):
+    # Checks the change log written by the API, the CSV import and the
+    # signals. Changes are written when their transaction commits, so these
+    # tests run in autocommit mode, like the API
+
+    def get_changes(self, **params):
+        response = self.client.get(reverse('song-changes'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_changes_since_cursor(self):
+        data = self.get_changes()
+        self.assertFalse(data['has_more'])
+        self.assertEqual(
+            [(change['song_id'], change['action']) for change in data['changes']],
+            [(self.song.id, 'created')],
+        )
+        self.assertEqual(data['changes'][0]['song']['name'], 'Test Song')
+
+        # Nothing changed since the returned cursor
+        cursor = data['cursor']
+        self.assertEqual(self.get_changes(since=cursor), {'cursor': cursor, 'has_more': False, 'changes': []})
+
+        self.song.rank = 5
+        self.song.save()
+        self.writer1.name = 'John Lennon'
+        self.writer1.save()
+        data = self.get_changes(since=cursor)
+        self.assertEqual([(change['song_id'], change['action']) for change in data['changes']], [(self.song.id, 'updated')])
+        self.assertEqual(data['changes'][0]['song']['writers'], [{'name': 'John Lennon'}])
+
+        song_id = self.song.id
+        self.song.delete()
+        data = self.get_changes(since=data['cursor'])
+        self.assertEqual(data['changes'], [{'song_id': song_id, 'action': 'deleted', 'song': None}])
+
+    def test_changes_pages(self):
+        for rank in range(2, 5):
+            Song.objects.create(
+                name=f'Song {rank}', album=self.album, rank=rank, year_released=2020, song_time='03:30',
+                spotify_streams=1, rolling_stone_ranking=rank, ug_views=1, ug_favourites=1,
+            )
+        # Test Song was created, then linked to its writer and singer
+        first = self.get_changes(limit=3)
+        self.assertTrue(first['has_more'])
+        second = self.get_changes(since=first['cursor'], limit=3)
+        self.assertFalse(second['has_more'])
+        names = [change['song']['name'] for change in first['changes'] + second['changes']]
+        self.assertEqual(names, ['Test Song', 'Song 2', 'Song 3', 'Song 4'])
+
+    def test_song_create_records_one_change(self):
+        self.client.login(username='evident', password='dev_interview')
+        cursor = self.get_changes()['cursor']
+        response = self.client.post(reverse('song-list'), {
+            'name': 'New Song', 'album': {'title': 'Test Album'}, 'rank': 2, 'year_released': 2021,
+            'song_time': '03:30', 'spotify_streams': 1, 'rolling_stone_ranking': 5, 'ug_views': 1,
+            'ug_favourites': 1, 'writers': [{'name': 'John Doe'}], 'singers': [{'name': 'Alice Cooper'}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            list(SongChange.objects.filter(id__gt=cursor).values_list('song_id', 'action')),
+            [(response.data['id'], 'created')],
+        )
+
+    def test_csv_import_records_changes(self):
+        # Free rank 1 for the imported songs
+        self.song.rank = 100
+        self.song.save()
+        cursor = self.get_changes()['cursor']
+        upload = SimpleUploadedFile('songs.csv', make_csv(3), content_type='text/csv')
+        self.client.post(reverse('Upload songs csv'), {'file': upload}, format='multipart')
+        self.assertEqual(
+            [change['song']['name'] for change in self.get_changes(since=cursor)['changes']],
+            ['Song 0', 'Song 1', 'Song 2'],
+        )
+
+    def test_changes_are_written_on_commit(self):
+        cursor = self.get_changes()['cursor']
+        with transaction.atomic():
+            self.song.rank = 5
+            self.song.save()
+            # A long transaction does not hold back an id that changes
+            # committed meanwhile would move the cursor past
+            self.assertFalse(SongChange.objects.filter(id__gt=cursor).exists())
+            Song.objects.create(
+                name='Song 2', album=self.album, rank=2, year_released=2020, song_time='03:30',
+                spotify_streams=1, rolling_stone_ranking=2, ug_views=1, ug_favourites=1,
+            )
+        data = self.get_changes(since=cursor)
+        self.assertEqual([change['action'] for change in data['changes']], ['updated', 'created'])
+
+    @override_settings(SONG_CHANGES_SAFETY_LAG=60)
+    def test_recent_changes_are_held_back(self):
+        # The cursor stops before the changes that may still have lower ids committing
+        self.assertEqual(self.get_changes(), {'cursor': 0, 'has_more': False, 'changes': []})
+
+        later = timezone.now() + timedelta(seconds=61)
+        with mock.patch('beatles.views.timezone.now', return_value=later):
+            data = self.get_changes()
+        self.assertEqual([change['song_id'] for change in data['changes']], [self.song.id])
+
+    @override_settings(SONG_CHANGES_SAFETY_LAG=60)
+    def test_changes_stop_at_the_first_recent_change(self):
+        SongChange.objects.update(changed_at=timezone.now() - timedelta(seconds=120))
+        settled = SongChange.objects.latest('id').id
+        Song.objects.create(
+            name='Song 2', album=self.album, rank=2, year_released=2020, song_time='03:30',
+            spotify_streams=1, rolling_stone_ranking=2, ug_views=1, ug_favourites=1,
+        )
+        with CaptureQueriesContext(connection) as queries:
+            data = self.get_changes()
+        self.assertEqual(data['cursor'], settled)
+        self.assertFalse(data['has_more'])
+        self.assertEqual([change['song_id'] for change in data['changes']], [self.song.id])
+        # The log is read once, without a lookup of the first recent change
+        self.assertEqual(len([query for query in queries if 'beatles_songchange' in query['sql']]), 1)
 
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('song-changes'), {'since': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
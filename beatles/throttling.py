@@ -0,0 +1,192 @@
+"""
+Rate limiting and load shedding for the API.
+
+Requests are limited with token buckets: each client gets a bucket of
+`num` tokens, refilled at `num` per period, for a rate of 'num/period' in
+REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], so short bursts are allowed while
+the average rate stays bounded. Buckets live in the THROTTLE_CACHE cache,
+in local memory by default, which limits each process on its own. Bucket
+updates are atomic within a process only: with a cache shared between
+processes, concurrent workers may each take the last token of a bucket.
+
+The number of concurrent CSV imports is capped exactly, across processes,
+with slots kept in the database (see ImportSlot).
+
+Throttles that only need the client IP run before authentication (see
+LoadSheddingMixin), so floods are rejected before any query is issued.
+"""
+from datetime import timedelta
+import math
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from .models import ImportLease
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Base class for token bucket throttles. Subclasses set `scope` and
+    implement get_cache_key().
+    """
+    # Whether get_cache_key() needs the authenticated user
+    needs_user = True
+    # Makes reading and updating a bucket atomic within the process
+    lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[settings.THROTTLE_CACHE]
+
+    def get_rate(self):
+        # Read the rates at request time so they follow settings changes
+        self.THROTTLE_RATES = api_settings.DEFAULT_THROTTLE_RATES
+        return super().get_rate()
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        refill_rate = self.num_requests / self.duration
+        with self.lock:
+            now = self.timer()
+            tokens, updated_at = self.cache.get(self.key, (self.num_requests, now))
+            tokens = min(self.num_requests, tokens + (now - updated_at) * refill_rate)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.wait_time = (1 - tokens) / refill_rate
+
+            # Once the bucket would be full again, a missing key means the same
+            self.cache.set(self.key, (tokens, now), math.ceil(self.duration))
+        return allowed
+
+    def wait(self):
+        return math.ceil(getattr(self, 'wait_time', 0))
+
+
+class IPThrottle(TokenBucketThrottle):
+    """
+    Limits every request by client IP, before authentication.
+    """
+    scope = 'ip'
+    needs_user = False
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class UserThrottle(TokenBucketThrottle):
+    """
+    Limits the requests of each authenticated user.
+    """
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if not request.user.is_authenticated:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': request.user.pk}
+
+
+class AnonSongListThrottle(TokenBucketThrottle):
+    """
+    Stricter limit, by IP, for unauthenticated song list requests, which
+    return every song at once.
+    """
+    scope = 'anon_songs'
+
+    def get_cache_key(self, request, view):
+        if request.user.is_authenticated:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class UploadThrottle(TokenBucketThrottle):
+    """
+    Limits CSV uploads by user, or by IP for unauthenticated uploads.
+    """
+    scope = 'upload'
+
+    def get_cache_key(self, request, view):
+        ident = request.user.pk if request.user.is_authenticated else self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class LoadSheddingMixin:
+    """
+    View mixin checking the throttles that do not need the user before the
+    request is authenticated, since authentication queries the database.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        throttles = [throttle for throttle in self.get_throttles() if not throttle.needs_user]
+        self.run_throttles(request, throttles)
+        super().initial(request, *args, **kwargs)
+
+    def check_throttles(self, request):
+        throttles = [throttle for throttle in self.get_throttles() if throttle.needs_user]
+        self.run_throttles(request, throttles)
+
+    def run_throttles(self, request, throttles):
+        # Same as APIView.check_throttles, for the given throttles
+        throttle_durations = []
+        for throttle in throttles:
+            if not throttle.allow_request(request, self):
+                throttle_durations.append(throttle.wait())
+        if throttle_durations:
+            self.throttled(request, max(throttle_durations))
+
+
+class ImportsBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many imports in progress, please retry later.'
+    default_code = 'imports_busy'
+
+    def __init__(self, wait):
+        super().__init__()
+        self.wait = wait
+
+
+class ImportSlot:
+    """
+    Context manager holding one of the CSV_IMPORT_MAX_CONCURRENT import
+    slots. Slots are ImportLease rows, taken with a conditional update, so
+    the cap holds across processes sharing the database.
+
+    Raises:
+    ImportsBusy: (503, with Retry-After) if every slot is taken.
+    """
+
+    def __enter__(self):
+        now = timezone.now()
+        slots = range(settings.CSV_IMPORT_MAX_CONCURRENT)
+        ImportLease.objects.bulk_create([ImportLease(slot=slot) for slot in slots], ignore_conflicts=True)
+
+        # A slot is free when released, or when its import died without releasing it
+        free = ImportLease.objects.filter(Q(held_until__isnull=True) | Q(held_until__lt=now), slot__in=slots)
+        held_until = now + timedelta(seconds=settings.CSV_IMPORT_SLOT_TIMEOUT)
+        for slot in list(free.values_list('slot', flat=True)):
+            # The update only matches while the slot is still free, so a
+            # single process can take it
+            if free.filter(slot=slot).update(held_until=held_until):
+                self.slot = slot
+                self.held_until = held_until
+                return self
+        raise ImportsBusy(wait=settings.CSV_IMPORT_RETRY_AFTER)
+
+    def __exit__(self, *exc_info):
+        # Unless the slot expired and was taken by another import meanwhile
+        ImportLease.objects.filter(slot=self.slot, held_until=self.held_until).update(held_until=None)
@@ -4,28 +4,54 @@ from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework import status
 
-# Swagger related imports
-from drf_yasg.utils import swagger_auto_schema
-from drf_yasg import openapi
+# Swagger related imports, drf_yasg itself is only loaded when the docs are requested
+from .docs import swagger_auto_schema
 
 from .serializers import SongSerializer, LimitedSongSerializer
-from .models import Song, Album, SongWriter, Singer
+from .models import Song, Album, SongWriter, Singer, SongChange
+from .changelog import record_changes
+from .csv_parser import iter_song_rows
+from .catalog import get_catalog, invalidate_catalog
+from .throttling import (
+    AnonSongListThrottle, ImportSlot, IPThrottle, LoadSheddingMixin, UploadThrottle, UserThrottle
+)
+from .lyrics_storage import read_lyrics, read_lyrics_archive, sanitize_song_name, save_many_lyrics
 
 # Other imports
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.http import FileResponse
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
 import csv
-from io import TextIOWrapper
 import os
-import re
+import pickle
+import tempfile
+import time
+import uuid
 
 
 
-class SongList(generics.ListCreateAPIView):
+class SongList(LoadSheddingMixin, generics.ListCreateAPIView):
     # Define the queryset to retrieve songs ordered by their rank
     queryset = Song.objects.all().order_by('rank')
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    # Unauthenticated clients get a stricter limit on the unpaginated list
+    throttle_classes = [IPThrottle, UserThrottle, AnonSongListThrottle]
     pagination_class = None # Disable pagination for this view
 
 
+    def list(self, request, *args, **kwargs):
+        # Serve the in-process catalog snapshot when it is enabled
+        catalog = get_catalog()
+        if catalog is None:
+            return super().list(request, *args, **kwargs)
+        if request.user.is_authenticated:
+            return Response(catalog.songs)
+        return Response(catalog.limited_songs)
+
     def get_serializer_class(self):
         # Return full or limited serializer based on user authentication
         if self.request.user.is_authenticated:
@@ -43,96 +69,455 @@ class SongList(generics.ListCreateAPIView):
             return Response({"detail": "Authentication required."}, status=status.HTTP_401_UNAUTHORIZED)
 
 
-class SongDetail(generics.RetrieveAPIView):
+class SongDetail(LoadSheddingMixin, generics.RetrieveAPIView):
     # Set up the view to retrieve a single song
     queryset = Song.objects.all()
     serializer_class = SongSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
 
-class CSVUploadView(APIView):
+class SongChangesView(LoadSheddingMixin, APIView):
+    # Change feed for mirrors keeping an incremental copy of the song list
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Songs changed after the `since` cursor, in the order of their latest change. "
+            "Pass the returned `cursor` as `since` in the next call, until `has_more` is false."
+        ),
+        manual_parameters=lambda openapi: [
+            openapi.Parameter(
+                'since',
+                openapi.IN_QUERY,
+                description="Cursor returned by the previous call, 0 (default) to get every change",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                'limit',
+                openapi.IN_QUERY,
+                description="Maximum number of changes to read",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            )
+        ],
+        responses=lambda openapi: {200: openapi.Response('Changed songs, the next cursor and whether more changes follow')}
+    )
+    def get(self, request, format=None):
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = int(request.query_params.get('limit', settings.SONG_CHANGES_PAGE_SIZE))
+        except ValueError:
+            return Response({'detail': "'since' and 'limit' must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, settings.SONG_CHANGES_MAX_PAGE_SIZE))
+
+        # Stop before the first change of the last SONG_CHANGES_SAFETY_LAG
+        # seconds: a change with a lower id may still be about to commit,
+        # and the cursor must not move past it (see changelog.py)
+        settled_before = timezone.now() - timedelta(seconds=settings.SONG_CHANGES_SAFETY_LAG)
+
+        # Read one change more than asked to know whether more follow
+        changes = list(SongChange.objects.filter(id__gt=since).order_by('id')[:limit + 1])
+        for index, change in enumerate(changes):
+            if change.changed_at > settled_before:
+                changes = changes[:index]
+                break
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        # Only the latest change of each song matters, but a song created
+        # within these changes is reported as created
+        latest = {}
+        created = set()
+        for change in changes:
+            latest.pop(change.song_id, None)
+            latest[change.song_id] = change
+            if change.action == SongChange.CREATED:
+                created.add(change.song_id)
+
+        songs = Song.objects.select_related('album').prefetch_related('writers', 'singers').in_bulk([
+            song_id for song_id, change in latest.items() if change.action != SongChange.DELETED
+        ])
+        serializer_class = self.get_serializer_class()
+
+        results = []
+        for song_id, change in latest.items():
+            if change.action == SongChange.DELETED:
+                results.append({'song_id': song_id, 'action': SongChange.DELETED, 'song': None})
+            elif song_id in songs:
+                results.append({
+                    'song_id': song_id,
+                    'action': SongChange.CREATED if song_id in created else SongChange.UPDATED,
+                    'song': serializer_class(songs[song_id]).data,
+                })
+            # Otherwise the song was deleted by a later change, which a next call returns
+
+        return Response({
+            'cursor': changes[-1].id if changes else since,
+            'has_more': has_more,
+            'changes': results,
+        })
+
+    def get_serializer_class(self):
+        # Same data as the song list: full or limited based on user authentication
+        if self.request.user.is_authenticated:
+            return SongSerializer
+        return LimitedSongSerializer
+
+
+class CSVUploadView(LoadSheddingMixin, APIView):
     # Specify parsers for handling file upload
     parser_classes = (MultiPartParser, FormParser)
+    throttle_classes = [IPThrottle, UserThrottle, UploadThrottle]
 
     @swagger_auto_schema(
-        operation_description="Upload a CSV file",
-        manual_parameters=[
+        operation_description="Upload a CSV file. Invalid rows are skipped and listed in a downloadable report.",
+        manual_parameters=lambda openapi: [
             openapi.Parameter(
                 name='file',
                 in_=openapi.IN_FORM,
-                description='CSV file to upload',
+                description='CSV file to upload. An optional Lyrics column holds the lyrics of each song.',
                 type=openapi.TYPE_FILE,
                 required=True
+            ),
+            openapi.Parameter(
+                name='lyrics_archive',
+                in_=openapi.IN_FORM,
+                description="Optional zip or tar archive of lyrics files named after the songs, e.g. 'hey-jude.txt'",
+                type=openapi.TYPE_FILE,
+                required=False
+            ),
+            openapi.Parameter(
+                name='dry_run',
+                in_=openapi.IN_QUERY,
+                description='Only validate the file, without reading or writing the database',
+                type=openapi.TYPE_BOOLEAN,
+                required=False
+            ),
+            openapi.Parameter(
+                name='check_existing',
+                in_=openapi.IN_QUERY,
+                description='With dry_run, also reject the songs and ranks already in the database (always done on imports)',
+                type=openapi.TYPE_BOOLEAN,
+                required=False
             )
         ],
-        responses={status.HTTP_201_CREATED: 'File uploaded successfully'}
+        responses={
+            status.HTTP_201_CREATED: 'File uploaded successfully',
+            status.HTTP_200_OK: 'File validated successfully (dry run)',
+            status.HTTP_429_TOO_MANY_REQUESTS: 'Too many uploads from this client',
+            status.HTTP_503_SERVICE_UNAVAILABLE: 'Too many imports in progress',
+        }
     )
     def post(self, request, format=None):
+        # Dry runs do not write anything, so they do not take an import slot
+        if query_flag(request, 'dry_run'):
+            return self.import_file(request)
+        # Only CSV_IMPORT_MAX_CONCURRENT imports run at once, before reading the upload
+        with ImportSlot():
+            return self.import_file(request)
+
+    def import_file(self, request):
         # Check if there is a file in the request
         if 'file' not in request.data:
             return Response({"message": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
 
         # Get the file from request
         file = request.data['file']
+        dry_run = query_flag(request, 'dry_run')
+        check_existing = not dry_run or query_flag(request, 'check_existing')
 
         # Process the file
-        self.process_csv(file)
+        try:
+            archive_lyrics = None
+            if 'lyrics_archive' in request.data:
+                archive_lyrics = read_lyrics_archive(request.data['lyrics_archive'])
+            valid, rejects, lyrics = self.process_csv(
+                file, dry_run=dry_run, archive_lyrics=archive_lyrics, check_existing=check_existing
+            )
+        except ValueError as error:
+            return Response({"message": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        report_url = None
+        if rejects:
+            report_id = self.save_report(rejects, get_report_owner(request.user))
+            report_url = request.build_absolute_uri(reverse('import-report', args=[report_id]))
 
-        return Response({"message": "File processed successfully"}, status=status.HTTP_201_CREATED)
+        data = {"valid": valid, "rejected": len(rejects), "lyrics": lyrics, "report": report_url}
+        if dry_run:
+            return Response({"message": "File validated successfully", **data}, status=status.HTTP_200_OK)
+        return Response({"message": "File processed successfully", **data}, status=status.HTTP_201_CREATED)
 
 
-    def process_csv(self, file):
+    def process_csv(self, file, dry_run=False, archive_lyrics=None, check_existing=True):
         """
         Processes a CSV file to create and populate Song, Album, SongWriter, and Singer models.
 
+        Parsing and validation are spread over worker processes (see csv_parser)
+        while the database writes stay in this process, in file order and in
+        batches. Invalid rows are skipped. The valid rows are spooled to a
+        temporary file while the upload is parsed, and only then written in
+        a single transaction, so the import is atomic without holding a
+        transaction open for the whole parse. Lyrics are handed to the
+        write-behind queue once the import is committed.
+
         Args:
         file: An uploaded file object containing song data.
+        dry_run (bool): Only validate the file, without writing to the database.
+        archive_lyrics (dict): Sanitized song name -> lyrics, used for songs
+        without a Lyrics cell.
+        check_existing (bool): Reject the songs and ranks already in the
+        database, with one query per batch of rows.
+
+        Returns:
+        tuple: The number of valid rows, a list of (row_number, reason) rejects
+        and the number of songs with lyrics.
+
+        Raises:
+        ValueError: If the file is missing required columns.
+        """
+        rows = iter_song_rows(
+            file,
+            workers=settings.CSV_IMPORT_WORKERS,
+            chunk_bytes=settings.CSV_IMPORT_CHUNK_BYTES,
+            # A Lyrics cell may be as long as a lyrics file of an archive
+            field_size_limit=settings.LYRICS_ARCHIVE_MAX_FILE_BYTES,
+        )
+        if check_existing:
+            rows = self.reject_existing_songs(rows)
+
+        valid = 0
+        rejects = []
+        lyrics = []
+        batch = []
+        # Small imports stay in memory, larger ones go to disk
+        with tempfile.SpooledTemporaryFile(max_size=settings.CSV_IMPORT_CHUNK_BYTES) as spool:
+            for row_number, row, error in rows:
+                if error is not None:
+                    rejects.append((row_number, error))
+                    continue
+                valid += 1
+
+                lyrics_text = row.pop('lyrics')
+                if lyrics_text is None and archive_lyrics:
+                    lyrics_text = archive_lyrics.get(sanitize_song_name(row['name']))
+                if lyrics_text:
+                    lyrics.append((row['name'], lyrics_text))
+
+                if dry_run:
+                    continue
+                batch.append(row)
+                if len(batch) >= settings.CSV_IMPORT_BATCH_SIZE:
+                    pickle.dump(batch, spool)
+                    batch = []
+            if batch:
+                pickle.dump(batch, spool)
+
+            if not dry_run and valid:
+                spool.seek(0)
+                self.save_spooled_songs(spool, lyrics)
+
+        return valid, rejects, len(lyrics)
+
+    def save_spooled_songs(self, spool, lyrics):
+        """
+        Writes the batches of rows spooled by process_csv, in one transaction.
+        """
+        lookups = {Album: {}, SongWriter: {}, Singer: {}}
+        with transaction.atomic():
+            while True:
+                try:
+                    batch = pickle.load(spool)
+                except EOFError:
+                    break
+                self.save_songs(batch, lookups)
+
+            # Bulk inserts do not send the signals that refresh the catalog
+            invalidate_catalog()
+
+            if lyrics:
+                transaction.on_commit(lambda: save_many_lyrics(lyrics))
+
+    def reject_existing_songs(self, rows):
+        """
+        Rejects the rows whose song (same name and album) or rank is already
+        in the database, checking CSV_IMPORT_BATCH_SIZE rows per query.
+
+        Args:
+        rows: (row_number, song, error) triples, as yielded by iter_song_rows.
+
+        Yields:
+        tuple: The same triples, in order, with an error set on the rejected rows.
+        """
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= settings.CSV_IMPORT_BATCH_SIZE:
+                yield from self.check_existing_songs(batch)
+                batch = []
+        yield from self.check_existing_songs(batch)
+
+    def check_existing_songs(self, batch):
+        songs = [song for _, song, _ in batch if song is not None]
+        existing = Song.objects.filter(
+            Q(rank__in={song['rank'] for song in songs}) | Q(name__in={song['name'] for song in songs})
+        ).values_list('name', 'album__title', 'rank') if songs else []
+        existing_songs = {(name, album) for name, album, _ in existing}
+        existing_ranks = {rank for _, _, rank in existing}
+
+        for row_number, song, error in batch:
+            if song is not None and (song['name'], song['album']) in existing_songs:
+                yield row_number, None, 'The song already exists'
+            elif song is not None and song['rank'] in existing_ranks:
+                yield row_number, None, f"Rank {song['rank']} is already used by an existing song"
+            else:
+                yield row_number, song, error
+
+    def save_report(self, rejects, owner):
+        """
+        Writes the rejected rows of an import to a CSV report, and deletes
+        the expired reports.
+
+        Args:
+        rejects (list): (row_number, reason) pairs.
+        owner (str): Who may download the report, see get_report_owner.
+
+        Returns:
+        str: The identifier of the report, used to download it.
         """
+        purge_expired_reports()
+        report_id = str(uuid.uuid4())
+        path = get_report_path(report_id, owner)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8', newline='') as report:
+            writer = csv.writer(report)
+            writer.writerow(['Row', 'Reason'])
+            writer.writerows(rejects)
+        return report_id
+
+    def save_songs(self, rows, lookups):
+        """
+        Creates the songs for a batch of parsed rows along with their album,
+        writers and singers.
 
-        # Process the CSV file and create database records
-        csv_file = TextIOWrapper(file, encoding='utf-8')
-        reader = csv.DictReader(csv_file)
-
-        for row in reader:
-            # Create or get the album for each song
-            album, _ = Album.objects.get_or_create(title=row['Album'])
-            song = Song.objects.create(
-                name=row['Song Name'],
-                album=album,
-                rank=int(row['Rank']),
-                year_released=int(row['Year Released']),
-                song_time=row['Song Time'],
-                spotify_streams=int(row['Spotify Streams'].replace(',', '')),
-                rolling_stone_ranking=int(row['Rolling Stone 100 Greatest Beatles Songs Ranking']),
-                ug_views=int(row['UG Views']),
-                ug_favourites=int(row['UG Favourites'])
+        Args:
+        rows (list): Typed song data as returned by csv_parser.parse_row.
+        lookups (dict): Per-model caches of name -> instance, shared between batches.
+        """
+        albums = self.get_or_create_by_name(Album, 'title', {row['album'] for row in rows}, lookups[Album])
+        writers = self.get_or_create_by_name(
+            SongWriter, 'name', {name for row in rows for name in row['writers']}, lookups[SongWriter]
+        )
+        singers = self.get_or_create_by_name(
+            Singer, 'name', {name for row in rows for name in row['singers']}, lookups[Singer]
+        )
+
+        songs = Song.objects.bulk_create([
+            Song(
+                album=albums[row['album']],
+                **{key: value for key, value in row.items() if key not in ('album', 'writers', 'singers')}
             )
+            for row in rows
+        ])
+
+        # Link the many-to-many relations directly through their join tables
+        song_writers = set()
+        song_singers = set()
+        for song, row in zip(songs, rows):
+            song_writers.update((song.id, writers[name].id) for name in row['writers'])
+            song_singers.update((song.id, singers[name].id) for name in row['singers'])
+
+        Song.writers.through.objects.bulk_create([
+            Song.writers.through(song_id=song_id, songwriter_id=writer_id)
+            for song_id, writer_id in song_writers
+        ])
+        Song.singers.through.objects.bulk_create([
+            Song.singers.through(song_id=song_id, singer_id=singer_id)
+            for song_id, singer_id in song_singers
+        ])
+
+        # Bulk inserts do not send the signals that write the change log
+        record_changes([song.id for song in songs], SongChange.CREATED)
+
+    def get_or_create_by_name(self, model, field, names, cache):
+        """
+        Returns a name -> instance mapping for the given names, fetching the
+        existing rows in one query and creating the missing ones in another.
+        """
+        missing = names - cache.keys()
+        if missing:
+            for instance in model.objects.filter(**{f'{field}__in': missing}):
+                cache.setdefault(getattr(instance, field), instance)
+            created = model.objects.bulk_create([
+                model(**{field: name}) for name in missing - cache.keys()
+            ])
+            for instance in created:
+                cache[getattr(instance, field)] = instance
+        return cache
+
+
+class ImportReportView(LoadSheddingMixin, APIView):
+    # Reports are only served to the user who uploaded the file, and for
+    # IMPORT_REPORT_TTL seconds
 
-            try:
-                song.nme_ranking= int(row['NME Top 50 Beatles Songs Ranking'])
-            except:
-                pass # empty row can not be converted to
+    @swagger_auto_schema(
+        operation_description="Download the rejected rows report of a CSV upload, as the user who uploaded it",
+        responses=lambda openapi: {200: openapi.Response('CSV report with the row number and reason of each rejected row')}
+    )
+    def get(self, request, report_id, format=None):
+        filepath = get_report_path(str(report_id), get_report_owner(request.user))
+        try:
+            expired = time.time() - os.path.getmtime(filepath) > settings.IMPORT_REPORT_TTL
+        except FileNotFoundError:
+            expired = True
+        if expired:
+            return Response({'detail': 'Report not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        return FileResponse(
+            open(filepath, 'rb'), as_attachment=True,
+            filename=f'rejected-rows-{report_id}.csv', content_type='text/csv'
+        )
+
+
+def query_flag(request, name):
+    return request.query_params.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def get_reports_dir():
+    return str(settings.IMPORT_REPORTS_DIR)
+
+
+def get_report_owner(user):
+    # Reports of anonymous uploads are only reachable through their random id
+    return f'user-{user.pk}' if user.is_authenticated else 'anonymous'
 
-            # Process and add writers for the song
-            for writer_name in row['Song Writer'].split('\n'):
-                writer, _ = SongWriter.objects.get_or_create(name=writer_name.strip())
-                song.writers.add(writer)
 
-            # Process and add singers for the song
-            for singer_name in row['Singer'].split('\n'):
-                singer, _ = Singer.objects.get_or_create(name=singer_name.strip())
-                song.singers.add(singer)
+def get_report_path(report_id, owner):
+    return os.path.join(get_reports_dir(), owner, f'{report_id}.csv')
 
-            song.save()
+
+def purge_expired_reports():
+    """
+    Deletes the reports older than IMPORT_REPORT_TTL seconds.
+    """
+    expires_before = time.time() - settings.IMPORT_REPORT_TTL
+    for directory, _, filenames in os.walk(get_reports_dir()):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                if os.path.getmtime(path) < expires_before:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass  # deleted by another worker
 
 
-class LyricsView(APIView):
+class LyricsView(LoadSheddingMixin, APIView):
     # Restrict this view to authenticated users only
     permission_classes = [permissions.IsAuthenticated]
 
     @swagger_auto_schema(
         operation_description="Get lyrics of a song",
-        manual_parameters=[
+        manual_parameters=lambda openapi: [
             openapi.Parameter(
                 'song_identifier',
                 openapi.IN_PATH,
@@ -141,26 +526,36 @@ class LyricsView(APIView):
                 required=True
             )
         ],
-        responses={200: openapi.Response('Lyrics of the song')}
+        responses=lambda openapi: {200: openapi.Response('Lyrics of the song')}
     )
     def get(self, request, song_identifier, format=None):
-        # Try to interpret song_identifier as an ID
-        try:
-            song_id = int(song_identifier)
-            song = Song.objects.get(pk=song_id)
-        except (ValueError, Song.DoesNotExist):
-            # If not an ID or not found, try to find by name
-            song_name = song_identifier.replace('-', ' ').lower()
-            song = Song.objects.filter(name__iexact=song_name).first()
+        # Resolve the song from the in-process catalog first, when enabled
+        catalog = get_catalog()
+        song = catalog.find_song(song_identifier) if catalog else None
+        if song is not None:
+            song_name = song['name']
+        else:
+            song = self.find_song(song_identifier)
             if not song:
                 return Response({'detail': 'Song not found'}, status=status.HTTP_404_NOT_FOUND)
+            song_name = song.name
 
         # Fetch and return lyrics
-        lyrics = self.get_lyrics(song.name)
+        lyrics = self.get_lyrics(song_name)
         if lyrics is None:
             return Response({'detail': 'Lyrics not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        return Response({'name': song.name, 'lyrics': lyrics})
+        return Response({'name': song_name, 'lyrics': lyrics})
+
+    def find_song(self, song_identifier):
+        # Try to interpret song_identifier as an ID
+        try:
+            song_id = int(song_identifier)
+            return Song.objects.get(pk=song_id)
+        except (ValueError, Song.DoesNotExist):
+            # If not an ID or not found, try to find by name
+            song_name = song_identifier.replace('-', ' ').lower()
+            return Song.objects.filter(name__iexact=song_name).first()
 
     def get_lyrics(self, song_name):
         """
@@ -172,15 +567,4 @@ class LyricsView(APIView):
         Returns:
         str: The lyrics of the song as a string, or None if the lyrics file is not found.
         """
-        # Create a filename from the song name by making it lower case,
-        # removing non-alphanumeric characters except spaces, and replacing spaces with hyphens
-        sanitized_song_name = re.sub(r'[^\w\s-]', '', song_name.lower()).replace(' ', '-')
-
-        views_dir = os.path.dirname(os.path.abspath(__file__))
-        filepath = os.path.join(views_dir, 'object_storage/lyrics', f'{sanitized_song_name}.txt')
-
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as file:
-                return file.read()
-        return None
-
+        return read_lyrics(song_name)
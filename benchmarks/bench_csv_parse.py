@@ -0,0 +1,55 @@
+"""
+Benchmark for the parallel CSV parse stage.
+
+Generates a synthetic song CSV and times beatles.csv_parser.iter_song_rows
+with an increasing number of worker processes. No database is needed.
+
+Usage:
+python benchmarks/bench_csv_parse.py [rows]
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beatles.csv_parser import iter_song_rows  # noqa: E402
+
+
+HEADER = (
+    'Song Name,Album,Song Writer,Singer,Rank,Year Released,Song Time,Spotify Streams,'
+    'Rolling Stone 100 Greatest Beatles Songs Ranking,NME Top 50 Beatles Songs Ranking,'
+    'UG Views,UG Favourites\n'
+)
+
+
+def make_csv(rows):
+    lines = [HEADER]
+    for i in range(rows):
+        lines.append(
+            f'Song {i},Album {i % 50},"Lennon\nMcCartney","Lennon\nMcCartney",{i + 1},1965,'
+            f'02:{i % 60:02d},"1,{i % 1000:03d},000",{i % 100 + 1},{"" if i % 2 else i % 50 + 1},'
+            f'{i * 10},{i}\n'
+        )
+    return ''.join(lines).encode('utf-8')
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    data = make_csv(rows)
+    print(f'{rows} rows, {len(data) / 1024 / 1024:.1f} MiB, {os.cpu_count()} CPUs')
+
+    workers = 1
+    baseline = None
+    while workers <= (os.cpu_count() or 1):
+        start = time.perf_counter()
+        count = sum(1 for _ in iter_song_rows(io.BytesIO(data), workers=workers))
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f'workers={workers:<3} {elapsed:7.2f}s  {count / elapsed:12,.0f} rows/s  x{baseline / elapsed:.2f}')
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark of worker startup: time to set Django up and import the URLconf,
+and latency of the first request, each measured in a fresh process.
+
+The first request goes to an endpoint that answers without touching the
+database, so only the startup cost is measured. Pass thresholds to fail
+(exit status 1) when startup regresses, e.g. in CI:
+
+python benchmarks/bench_startup.py --runs 5 --max-startup-ms 400 --max-first-request-ms 100
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def run_worker():
+    start = time.perf_counter()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'media_company.settings')
+
+    import django
+    from django.conf import settings
+    from django.urls import get_resolver
+    django.setup()
+    get_resolver().url_patterns  # import the URLconf and every view
+    ready = time.perf_counter()
+
+    from django.test import Client
+    settings.ALLOWED_HOSTS = ['testserver']
+    # Unauthenticated lyrics requests are rejected before any query
+    response = Client().get('/beatles/songs/lyrics/1/')
+    done = time.perf_counter()
+
+    assert response.status_code == 401, response.status_code
+    print((ready - start) * 1000, (done - ready) * 1000, 'drf_yasg' in sys.modules)
+
+
+def main():
+    if sys.argv[1:] == ['--worker']:
+        run_worker()
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-startup-ms', type=float)
+    parser.add_argument('--max-first-request-ms', type=float)
+    args = parser.parse_args()
+
+    startups, first_requests = [], []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, __file__, '--worker'], check=True, capture_output=True, text=True
+        ).stdout.split()
+        startups.append(float(output[0]))
+        first_requests.append(float(output[1]))
+        docs_loaded = output[2] == 'True'
+
+    startup = statistics.median(startups)
+    first_request = statistics.median(first_requests)
+    print(f'startup {startup:7.1f}ms  first request {first_request:7.1f}ms  '
+          f'drf_yasg loaded: {docs_loaded}  (median of {args.runs} runs)')
+
+    failed = False
+    if args.max_startup_ms is not None and startup > args.max_startup_ms:
+        print(f'startup is slower than {args.max_startup_ms}ms')
+        failed = True
+    if args.max_first_request_ms is not None and first_request > args.max_first_request_ms:
+        print(f'first request is slower than {args.max_first_request_ms}ms')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
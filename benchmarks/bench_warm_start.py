@@ -0,0 +1,73 @@
+"""
+Benchmark of the time-to-first-fast-response of a new worker, with and
+without the warm-start catalog snapshot.
+
+Each mode runs in a fresh process that sets Django up (which loads the
+snapshot, if enabled) and then requests the song list until a response is
+as fast as the steady state. The database configured by
+DJANGO_SETTINGS_MODULE must be migrated and hold some songs.
+
+Usage:
+python benchmarks/bench_warm_start.py [snapshot-file]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+REQUESTS = 50
+
+
+def run_worker(mode):
+    start = time.perf_counter()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'media_company.settings')
+
+    import django
+    from django.conf import settings
+    settings.CATALOG_SNAPSHOT = mode or None
+    settings.ALLOWED_HOSTS = ['testserver']
+    django.setup()
+    ready = time.perf_counter()
+
+    from django.test import Client
+    client = Client()
+    latencies = []
+    for _ in range(REQUESTS):
+        request_start = time.perf_counter()
+        client.get('/beatles/songs/')
+        latencies.append(time.perf_counter() - request_start)
+
+    # A response is fast once it is within 20% of the steady state median
+    steady = statistics.median(latencies[REQUESTS // 2:])
+    first_fast = next(i for i, latency in enumerate(latencies) if latency <= steady * 1.2)
+    first_fast_at = ready + sum(latencies[:first_fast + 1]) - start
+
+    print(
+        f'{mode or "cold":<12} setup {ready - start:6.3f}s  first response {latencies[0] * 1000:8.1f}ms  '
+        f'steady {steady * 1000:6.1f}ms  first fast response after {first_fast_at:6.3f}s (request #{first_fast + 1})'
+    )
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--worker':
+        run_worker(sys.argv[2] if sys.argv[2] != 'cold' else None)
+        return
+
+    modes = ['cold', 'db']
+    if len(sys.argv) > 1:
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT, 'manage.py'), 'dump_catalog_snapshot', sys.argv[1]],
+            check=True,
+        )
+        modes.append(sys.argv[1])
+
+    for mode in modes:
+        subprocess.run([sys.executable, __file__, '--worker', mode], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
+    # The tests run offline, against their own settings
+    if sys.argv[1:2] == ['test']:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'media_company.settings_test')
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'media_company.settings')
     try:
         from django.core.management import execute_from_command_line
@@ -27,6 +27,10 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# Serve the Swagger/Redoc API docs. drf_yasg is only loaded when they are
+# enabled, so turning them off in production makes workers start faster.
+API_DOCS_ENABLED = DEBUG
+
 
 # Application definition
 
@@ -39,9 +43,11 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'beatles.apps.BeatlesConfig',
     'rest_framework',
-    'drf_yasg',
 ]
 
+if API_DOCS_ENABLED:
+    INSTALLED_APPS.append('drf_yasg')
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -95,8 +101,119 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
+    # The browsable API is only useful while developing
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ] + (['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
+    # Token buckets, see beatles/throttling.py: 'num/period' allows bursts of
+    # num requests, refilled at num per period
+    'DEFAULT_THROTTLE_CLASSES': [
+        'beatles.throttling.IPThrottle',
+        'beatles.throttling.UserThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'ip': '300/min',
+        'user': '120/min',
+        'anon_songs': '20/min',
+        'upload': '20/hour',
+    },
+    # Number of reverse proxies in front of the app, whose X-Forwarded-For
+    # entries identify clients. With 0 the client IP is REMOTE_ADDR, as any
+    # client can send its own X-Forwarded-For header.
+    'NUM_PROXIES': 0,
+}
+
+# Cache
+# Throttle state lives in the THROTTLE_CACHE cache. Local memory limits each
+# process separately. A cache shared between processes, like the database
+# cache, makes the limits approximately global: its updates are not atomic,
+# so concurrent workers may let a few extra requests through.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'throttle',
+    },
 }
 
+THROTTLE_CACHE = 'throttle'
+
+# CSV import
+# Number of worker processes used to parse uploads (None uses every CPU),
+# size of the chunks handed to each worker and number of songs per insert.
+
+CSV_IMPORT_WORKERS = None
+
+CSV_IMPORT_CHUNK_BYTES = 4 * 1024 * 1024
+
+CSV_IMPORT_BATCH_SIZE = 500
+
+# At most CSV_IMPORT_MAX_CONCURRENT imports run at once, across processes,
+# further uploads get a 503 asking to retry after CSV_IMPORT_RETRY_AFTER
+# seconds. A slot is freed after CSV_IMPORT_SLOT_TIMEOUT seconds in case a
+# worker dies mid-import.
+
+CSV_IMPORT_MAX_CONCURRENT = 2
+
+CSV_IMPORT_RETRY_AFTER = 30
+
+CSV_IMPORT_SLOT_TIMEOUT = 3600
+
+# Object storage
+# Directories holding the lyrics files and the rejected rows reports of CSV imports.
+
+LYRICS_STORAGE_DIR = BASE_DIR / 'beatles' / 'object_storage' / 'lyrics'
+
+IMPORT_REPORTS_DIR = BASE_DIR / 'beatles' / 'object_storage' / 'import_reports'
+
+# Rejected rows reports can be downloaded, and are then deleted, after this many seconds.
+
+IMPORT_REPORT_TTL = 24 * 3600
+
+# Lyrics storage
+# Lyrics files are written in the background by a pool of threads, in
+# batches of up to LYRICS_WRITE_BATCH_SIZE files.
+
+LYRICS_WRITE_WORKERS = 4
+
+LYRICS_WRITE_BATCH_SIZE = 64
+
+# Limits of the lyrics archives uploaded with CSV imports: number of files,
+# and uncompressed size of each lyrics file and of all of them.
+
+LYRICS_ARCHIVE_MAX_FILES = 10000
+
+LYRICS_ARCHIVE_MAX_FILE_BYTES = 1024 * 1024
+
+LYRICS_ARCHIVE_MAX_BYTES = 64 * 1024 * 1024
+
+# Song change feed
+# Number of changes read per call by default, and at most.
+
+SONG_CHANGES_PAGE_SIZE = 500
+
+SONG_CHANGES_MAX_PAGE_SIZE = 5000
+
+# Changes younger than this many seconds are held back, until every change
+# with a lower id is surely committed. It must exceed the time taken to write
+# a batch of changes, plus any clock difference between the app servers.
+
+SONG_CHANGES_SAFETY_LAG = 10
+
+# Catalog snapshot
+# Loads the song catalog into memory when a worker starts: None disables it,
+# 'db' loads it with bulk queries, or the path of a file written by
+# `manage.py dump_catalog_snapshot`. The in-memory catalog is reloaded from
+# the database CATALOG_CACHE_TTL seconds after it was read (snapshot files
+# included) or when this process changes it.
+
+CATALOG_SNAPSHOT = None
+
+CATALOG_CACHE_TTL = 300
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
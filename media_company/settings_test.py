@@ -0,0 +1,35 @@
+"""
+Django settings for running the tests.
+
+Used by default by `python manage.py test`. The tests run offline against
+an in-memory SQLite database, and store lyrics and import reports in a
+temporary directory, so they can run in parallel:
+
+python manage.py test --parallel
+"""
+
+import os
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+# Tests create users and log in often, a fast hasher keeps that cheap
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+]
+
+# Never write to the real object storage. The test cases use a temporary
+# directory of their own, this one is only a fallback, removed at exit.
+storage_dir = tempfile.TemporaryDirectory(prefix='beatles-tests-')
+
+LYRICS_STORAGE_DIR = os.path.join(storage_dir.name, 'lyrics')
+
+IMPORT_REPORTS_DIR = os.path.join(storage_dir.name, 'import_reports')